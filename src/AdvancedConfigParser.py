@@ -44,6 +44,14 @@ baz = foo if Section_1.pi < 2**2 < Section_1.Sub_Sec_1.tau/2 or True else bar
 
 Configuration can be loaded from strings (parse_string()),
 files (parse_file()) or file-like objects (parse_stream()).
+iter_events() reports sections and options while reading without building
+a tree and the parse functions accept patterns restricting what is kept.
+A parsed config is updated in place by reload_file(), reload_string()
+and reload_stream() re-parsing only the options that changed.
+Parsed trees may be read and changed from several threads at once. see
+LazyEval for the details.
+Section.export_snapshot() turns a config into an immutable flat binary
+snapshot that other processes open cheaply with attach_snapshot().
 Access to the sections and options is done by attribute access:
 >>> config = AdvancedConfigParser.parse_string("filename")
 >>> print(config.global_var)
@@ -56,93 +64,832 @@ except ImportError:
     import builtins
 
 import io
+import os
 import re
 import ast
+import struct
+import threading
+import weakref
+import time
 import operator
+import collections
 
-from ast_to_src import ast_to_src
+# pickle, hashlib, mmap, fnmatch and ast_to_src are only needed by some
+# features and imported where they are used to keep the import fast.
 
-def parse_file(filename):
+# operators and builtin functions the evaluator is allowed to use
+_BINARY_OPERATORS = {ast.Add: operator.add, ast.Sub: operator.sub,
+                     ast.Mult: operator.mul, ast.Div: operator.truediv,
+                     ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod,
+                     ast.Pow: operator.pow, ast.LShift: operator.lshift,
+                     ast.RShift: operator.rshift, ast.BitOr: operator.or_,
+                     ast.BitXor: operator.xor, ast.BitAnd: operator.and_,}
+_COMPARE_OPERATORS = {ast.Eq: operator.eq, ast.NotEq: operator.ne,
+                      ast.Lt: operator.lt, ast.LtE: operator.le,
+                      ast.Gt: operator.gt, ast.GtE: operator.ge,
+                      ast.Is: operator.is_, ast.IsNot: operator.is_not,
+                      # don't use contains because arguments are reversed
+                      ast.In: lambda a, b: a in b,
+                      ast.NotIn: lambda a, b: a not in b}
+_CONTAINER_TYPES = {ast.List: list, ast.Tuple: tuple, ast.Set: set}
+_BUILTIN_FUNCTIONS = frozenset(("abs", "all", "any", "bin", "bool", "chr",
+                                "complex", "dict", "divmod", "enumerate",
+                                "float", "hex", "int", "len", "list", "max",
+                                "min", "oct", "ord", "pow", "range",
+                                "reversed", "round", "set", "sorted", "str",
+                                "sum", "tuple", "type", "unichr", "zip", ))
+
+# limits of the constants made by Section.fold_constants(), the same as in
+# the ast optimizer of CPython
+_FOLD_MAX_INT_BITS = 128
+_FOLD_MAX_COLLECTION_SIZE = 256
+_FOLD_MAX_STR_SIZE = 4096
+
+# namedtuple types made by Section.extract() by typename and fields
+_EXTRACT_TYPES = {}
+
+# characters or bytes requested per read of a stream
+_READ_SIZE = 1 << 16
+
+# bump whenever the pickled layout of Section or Option changes
+_CACHE_FORMAT = 3
+_CACHE_DIR = "__acpcache__"
+
+# layout of snapshots made by Section.export_snapshot(). the header holds
+# magic, format and the number of entries. the entries are sorted by their
+# utf-8 encoded dotted key and hold offset and length of the key and of the
+# pickled value and a flag marking sections, which have no value.
+_SNAPSHOT_MAGIC = b"ACPS"
+_SNAPSHOT_FORMAT = 1
+_SNAPSHOT_HEADER = struct.Struct("<4sII")
+_SNAPSHOT_ENTRY = struct.Struct("<IIIIB")
+
+# marks options whose value has not been evaluated yet
+_NOT_CACHED = object()
+# guards the caches of unevaluated options, the dependents and the
+# reference index against concurrent changes
+_GRAPH_LOCK = threading.RLock()
+# maps threads to the _Evaluation they are waiting for
+_WAITING = {}
+
+# tokens that matter for finding the end of a multi-line option
+_CONTINUATION_TOKEN = re.compile(r"""[][(){}#\\]|'''|\"\"\"|'|\"""")
+# characters that start strings, comments or escapes
+_QUOTE_OR_ESCAPE = re.compile(r"""['"#\\]""")
+# end of a string opened by the given quotes. escapes are skipped.
+_STRING_END = {
+    "'": re.compile(r"(?:[^\\'\n]|\\.)*'", re.S),
+    '"': re.compile(r'(?:[^\\"\n]|\\.)*"', re.S),
+    "'''": re.compile(r"(?:[^\\']|\\.|'(?!''))*'''", re.S),
+    '"""': re.compile(r'(?:[^\\"]|\\.|"(?!""))*"""', re.S),
+}
+# brackets and name of a section header
+_SECTION_HEADER = re.compile(r"(\[+)([^\d\W]\w*)(\]+)")
+# wildcards of fnmatch patterns
+_WILDCARD = re.compile(r"[*?[]")
+# name and "=" of a plain option assignment
+_OPTION_NAME = re.compile(r"([^\d\W]\w*)\s*=(?!=)")
+
+def _acp_scan_line(line, depth=0, quote=None):
+    """
+    scan one physical line of an option for open brackets and strings.
+    depth and quote are the state left over from the previous line.
+    returns a 3-tuple (depth, quote, continued) where continued tells if
+    the logical line goes on with the next physical line.
+    """
+    if quote is None and _QUOTE_OR_ESCAPE.search(line) is None:
+        # only the brackets matter
+        depth += (line.count("(") + line.count("[") + line.count("{") -
+                  line.count(")") - line.count("]") - line.count("}"))
+        return depth, None, depth > 0
+    pos = 0
+    while True:
+        if quote is not None:
+            result = _STRING_END[quote].match(line, pos)
+            if result is None:
+                if len(quote) == 1 and not _acp_ends_with_escape(line):
+                    # unterminated string. let ast.parse complain about it.
+                    return depth, None, False
+                return depth, quote, True
+            pos = result.end()
+            quote = None
+        result = _CONTINUATION_TOKEN.search(line, pos)
+        if result is None or result.group() == "#":
+            break
+        token = result.group()
+        pos = result.end()
+        if token in "([{":
+            depth += 1
+        elif token in ")]}":
+            depth -= 1
+        elif token == "\\":
+            if not line[pos:].strip("\r\n"):
+                return depth, None, True
+        else:
+            quote = token
+    return depth, None, depth > 0
+
+def _acp_ends_with_escape(line):
+    """
+    returns True if line ends in a backslash escaping the line break.
+    """
+    stripped = line.rstrip("\r\n")
+    return (len(stripped) - len(stripped.rstrip("\\"))) % 2 == 1
+
+def _acp_is_literal(node):
+    """
+    returns True if the ast-node is a literal whose repr() is valid source.
+    """
+    if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+        return all(_acp_is_literal(elt) for elt in node.elts)
+    elif isinstance(node, ast.Dict):
+        return (None not in node.keys and
+                all(_acp_is_literal(child) for child in node.keys) and
+                all(_acp_is_literal(child) for child in node.values))
+    elif isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        return _acp_is_literal(node.operand)
+    if not isinstance(node, ast.Constant):
+        return False
+    elif isinstance(node.value, (float, complex)):
+        # inf and nan have no literal representation
+        return node.value - node.value == 0
+    return node.value is not Ellipsis
+
+def _acp_is_constant(value):
+    """
+    returns True if value is immutable and its repr() is valid source.
+    """
+    if isinstance(value, tuple):
+        return all(_acp_is_constant(item) for item in value)
+    elif isinstance(value, (float, complex)):
+        # inf and nan have no literal representation
+        return value - value == 0
+    return value is None or isinstance(value, (bool, int, str, bytes))
+
+def _acp_is_small(value):
+    """
+    returns True if value is within the size limits of folded constants.
+    """
+    if isinstance(value, (str, bytes)):
+        return len(value) <= _FOLD_MAX_STR_SIZE
+    elif isinstance(value, tuple):
+        return (len(value) <= _FOLD_MAX_COLLECTION_SIZE and
+                all(_acp_is_small(item) for item in value))
+    return True
+
+def _acp_fold(node):
+    """
+    returns the ast-nodes with every sub-expression that has no references
+    replaced by an ast.Constant of its value if that value is a small
+    constant. sub-expressions that fail to evaluate or could get large
+    are left alone and are evaluated when the option is.
+    """
+    if (isinstance(node, ast.expr) and not isinstance(node, ast.Constant) and
+            next(LazyEval._acp_references(node), None) is None):
+        try:
+            value, has_refs = _FoldingLazyEval()._acp_eval(None, node, set())
+        except Exception:
+            pass
+        else:
+            if _acp_is_constant(value) and _acp_is_small(value):
+                return ast.copy_location(ast.Constant(value), node)
+    for field, child in ast.iter_fields(node):
+        if isinstance(child, ast.AST):
+            setattr(node, field, _acp_fold(child))
+        elif isinstance(child, list):
+            child[:] = [_acp_fold(item) if isinstance(item, ast.AST) else item
+                        for item in child]
+    return node
+
+def parse_file(filename, compiled=False, compact=False, cache=False,
+               only=None, lazy=False):
+    """
+    see parse_stream() for compiled, compact and only.
+    if cache is True the parsed tree is stored in a "__acpcache__"
+    directory next to the file and reused as long as the file is unchanged.
+    if lazy is True only the options before the first section are parsed
+    right away. the other top-level sections are read from the file and
+    parsed on their first access. if the file changed in the meantime that
+    access raises a RuntimeError. lazy is ignored together with cache or
+    only.
+    """
+    if cache:
+        return _acp_parse_file_cached(filename, compiled, compact, only)
+    if lazy and only is None:
+        return _acp_parse_file_lazy(filename, compiled, compact)
     with open(filename) as f:
-        return parse_stream(f)
+        return parse_stream(f, compiled, compact, only)
+
+def _acp_parse_file_cached(filename, compiled, compact, only):
+    """
+    load the parsed tree from the cache file if it was made from the same
+    source with the same options. otherwise parse the file and write the
+    tree with its static values already evaluated to the cache file.
+    the cache is keyed by path and options and validated by mtime and
+    size or, if those changed, by the hash of the content.
+    """
+    import pickle
+    directory, basename = os.path.split(os.path.abspath(filename))
+    cache_filename = os.path.join(directory, _CACHE_DIR, basename + ".pickle")
+    key = (_CACHE_FORMAT, os.path.join(directory, basename), compiled, compact,
+           None if only is None else tuple(only))
+    stat = os.stat(filename)
+    source = None
+    try:
+        with open(cache_filename, "rb") as f:
+            header = pickle.load(f)
+            if header["key"] == key:
+                if (header["mtime"], header["size"]) == (stat.st_mtime_ns,
+                                                         stat.st_size):
+                    return pickle.load(f)
+                with open(filename) as source_file:
+                    source = source_file.read()
+                if header["hash"] == _acp_hash(source):
+                    return pickle.load(f)
+    except Exception:
+        # missing, stale or broken cache files are simply replaced
+        pass
+    if source is None:
+        with open(filename) as f:
+            source = f.read()
+    root = parse_string(source, compiled, compact, only)
+    root._acp_evaluate_static()
+    header = {"key": key, "mtime": stat.st_mtime_ns, "size": stat.st_size,
+              "hash": _acp_hash(source)}
+    try:
+        if not os.path.isdir(os.path.dirname(cache_filename)):
+            os.makedirs(os.path.dirname(cache_filename))
+        tmp_filename = "{0}.{1}.tmp".format(cache_filename, os.getpid())
+        with open(tmp_filename, "wb") as f:
+            pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(root, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_filename, cache_filename)
+    except (IOError, OSError):
+        # the cache is an optimization only
+        pass
+    return root
 
-def parse_string(s):
-    return parse_stream(io.StringIO(s))
+def _acp_parse_file_lazy(filename, compiled, compact):
+    """
+    find the top-level sections with a quick pass over the lines that only
+    follows multi-line options and add them as _LazySection to the root.
+    the file is decoded like open() does in text mode.
+    """
+    import locale
+    encoding = locale.getpreferredencoding(False)
+    with open(filename, "rb") as f:
+        stat = os.fstat(f.fileno())
+        starts = _acp_find_sections(f, encoding)
+        end = starts[0][1] if starts else stat.st_size
+        f.seek(0)
+        root = parse_string(f.read(end).decode(encoding), compiled, compact)
+    source = (filename, stat.st_mtime_ns, stat.st_size, encoding)
+    for i, (section_name, start, line) in enumerate(starts):
+        end = starts[i + 1][1] if i + 1 < len(starts) else stat.st_size
+        root._acp_add_child(_LazySection(section_name, source, start, end,
+                                         line, compiled, compact))
+    return root
 
-def parse_stream(stream):
+def _acp_find_sections(source, encoding):
     """
-    parse the stream into a hirarchical tree of (sub-)sections and options.
-    return the root/global section.
+    returns the name, the byte offset and the line number of every
+    top-level section header in source which is read with readline() as
+    bytes in the given encoding. only multi-line options are followed,
+    nothing is parsed.
     """
-    root = current_section = Section()
-    current_section._acp_name = "<global>"
-    current_nesting_level = 0
-    line = 0
+    starts = []
+    names = set()
+    continued = False
+    depth, quote = 0, None
+    line_number = 0
     while True:
-        buf = ""
-        tmp = stream.readline()
-        line += 1
-        if tmp == "":
+        offset = source.tell()
+        line = source.readline()
+        if not line:
             break
-        buf += tmp
-        stripped_buf = buf.strip()
+        line_number += 1
+        line = line.decode(encoding)
+        if continued:
+            depth, quote, continued = _acp_scan_line(line, depth, quote)
+            continue
+        stripped = line.strip()
+        if not stripped or stripped.startswith("#"):
+            continue
+        elif stripped.startswith("["):
+            result = _SECTION_HEADER.match(stripped)
+            if (result is not None and
+                    len(result.group(1)) == len(result.group(3)) == 1):
+                section_name = result.group(2)
+                if section_name in names:
+                    msg = 'duplicate section "{section_name}".'
+                    raise SyntaxError(msg.format(**locals()))
+                names.add(section_name)
+                starts.append((section_name, offset, line_number))
+        else:
+            depth, quote, continued = _acp_scan_line(line)
+    return starts
 
-        # preserve empty lines
-        if not stripped_buf:
-            current_section._acp_add_empty_line()
-        # ignore comments
-        elif stripped_buf.startswith("#"):
-            current_section._acp_add_comment(stripped_buf)
+def parse_files(filenames, compiled=False, compact=False, workers=None):
+    """
+    parse several files in a pool of worker processes and merge them into
+    one tree in the given order. options of later files override those of
+    the same name in earlier files and sections of the same path are
+    merged. references are resolved in the merged tree.
+    the files are split at their top-level sections into about four
+    chunks per worker so a single large file is parsed in parallel, too.
+    workers defaults to the number of cpus. with one worker or a single
+    chunk everything is parsed in this process.
+    see parse_stream() for compiled and compact.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    sources = []
+    for filename in filenames:
+        with open(filename, "rb") as f:
+            sources.append(f.read())
+    target = max(sum(len(source) for source in sources) // (workers * 4), 1)
+    tasks = []
+    for source in sources:
+        # cut at the first top-level section after every target bytes
+        start, line = 0, 1
+        sections = []
+        if workers > 1:
+            sections = _acp_find_sections(io.BytesIO(source), "utf-8")
+        for section_name, offset, section_line in sections:
+            if offset - start >= target:
+                tasks.append((source[start:offset], line, compiled, compact))
+                start, line = offset, section_line
+        tasks.append((source[start:], line, compiled, compact))
+    if workers == 1 or len(tasks) == 1:
+        parsed = map(_acp_parse_chunk, tasks)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(min(workers, len(tasks))) as executor:
+            parsed = list(executor.map(_acp_parse_chunk, tasks))
+    parsed = iter(parsed)
+    root = next(parsed, None)
+    if root is None:
+        return parse_string("", compiled, compact)
+    for chunk in parsed:
+        root._acp_merge(chunk)
+    return root
 
-        # handle section header
-        elif stripped_buf.startswith("["):
-            result = re.match(r"(\[+)([^\d\W]\w*)(\]+)", stripped_buf)
-            if result is None:
-                msg = "malformed section header in line {line}:\n{tmp}"
-                raise SyntaxError(msg.format(**locals()))
-            if len(result.group(1)) != len(result.group(3)):
-                msg = "section braket mismatch in line {line}:\n{tmp}"
-                raise SyntaxError(msg.format(**locals()))
-            level = min(len(result.group(1)), len(result.group(3)))
-            if level > current_nesting_level + 1:
-                msg = "wrong section nesting in line {line}"
-                raise SyntaxError(msg.format(**locals()))
-            while current_nesting_level >= level:
-                current_section = current_section._acp_parent
-                current_nesting_level -= 1
-            section_name = ast.parse(result.group(2)).body[0].value.id
-            if section_name in list(current_section._acp_section_names()):
-                msg = 'duplicate section "{section_name}".'.format(**locals())
-                raise SyntaxError(msg)
-            new_section = Section()
-            new_section._acp_name = section_name
-            current_section._acp_add_child(new_section)
-            current_section = new_section
-            current_nesting_level += 1
+def _acp_parse_chunk(task):
+    """
+    parse a part of a file starting at the given line number.
+    """
+    source, line, compiled, compact = task
+    # pad with empty lines so that errors report the line in the file
+    root = parse_string("\n" * (line - 1) + source.decode("utf-8"),
+                        compiled, compact)
+    del root.__dict__["_acp_order"][:line - 1]
+    return root
+
+def _acp_hash(source):
+    import hashlib
+    return hashlib.sha1(source.encode("utf-8")).hexdigest()
 
+def parse_string(s, compiled=False, compact=False, only=None):
+    return parse_stream(io.StringIO(s), compiled, compact, only)
+
+def parse_stream(stream, compiled=False, compact=False, only=None):
+    """
+    parse the stream into a hirarchical tree of (sub-)sections and options.
+    return the root/global section.
+    if compiled is True every option is compiled into a tree of closures
+    right away instead of interpreting its ast-nodes on each evaluation.
+    unsupported expressions then raise a SyntaxError while parsing.
+    if compact is True options holding plain literals store only their
+    value and drop the ast-nodes. their source text is regenerated from
+    the value when dumping.
+    only optionally restricts the tree to what the patterns select, see
+    iter_events(). references to anything else fail on evaluation.
+    """
+    root = Section()
+    root._acp_name = "<global>"
+    sections = [root]
+    for event in iter_events(stream, only):
+        kind = event[0]
+        current_section = sections[-1]
         # handle options
-        else:
-            node = None
-            while node is None and tmp != "":
-                try:
-                    node = ast.parse(stripped_buf)
-                except SyntaxError:
-                    tmp = stream.readline()
-                    buf += tmp
-                    stripped_buf = buf.strip()
-            node = node.body[0]
-            assert isinstance(node, ast.Assign)
-            option_name = node.targets[0].id
-            if option_name in list(current_section._acp_option_names()):
+        if kind == "option":
+            option_name, node, source = event[2:]
+            if current_section._acp_has_option(option_name):
                 msg = ('duplicate option "{option_name}" in '
                        'section "{current_section._acp_name}".')
                 raise SyntaxError(msg.format(**locals()))
             new_option = Option()
             new_option._acp_name = option_name
-            new_option._acp_value = node.value
+            new_option._acp_define(node, source, compiled, compact)
             current_section._acp_add_child(new_option)
+
+        # handle sections
+        elif kind == "enter":
+            section_name = event[1][-1]
+            if current_section._acp_has_section(section_name):
+                msg = 'duplicate section "{section_name}".'.format(**locals())
+                raise SyntaxError(msg)
+            new_section = Section()
+            new_section._acp_name = section_name
+            current_section._acp_add_child(new_section)
+            sections.append(new_section)
+        elif kind == "exit":
+            sections.pop()
+
+        # preserve comments and empty lines
+        elif kind == "comment":
+            current_section._acp_add_comment(event[2])
+        else:
+            current_section._acp_add_empty_line()
     return root
 
+def iter_events(stream, only=None):
+    """
+    parse the stream step by step without building a tree.
+    yields tuples whose first item is the kind of event and whose second
+    item is the path of the current section as tuple of names:
+        ("enter", path)                        a section starts
+        ("exit", path)                         a section ends
+        ("option", path, name, node, source)   an option with its value
+                                               as ast-node and source text
+        ("comment", path, text)
+        ("empty", path)
+    only is an optional list of fnmatch patterns like "Section_1.*" for
+    the dotted names of sections and options. then only matching options,
+    matching sections with all their content and the sections leading to
+    them are reported. sections containing nothing selected are not
+    reported at all. other parts of the stream are skipped without
+    parsing their options.
+    """
+    if only is not None:
+        import fnmatch
+        # the part of every pattern before its first wildcard
+        prefixes = [_WILDCARD.split(pattern, 1)[0] for pattern in only]
+    path = ()
+    # per section on path, "all" if it is selected with all its content,
+    # "some" if it may contain selected parts and "none" otherwise
+    states = ["all" if only is None else "some"]
+    # the number of sections on path reported by "enter" so far. those
+    # that may contain selected parts are only entered once they do.
+    entered = 0
+    for kind, line, text in _acp_iter_lines(stream):
+        state = states[-1]
+        if kind == "section":
+            level, section_name = _acp_parse_header(text, line)
+            if level > len(path) + 1:
+                msg = "wrong section nesting in line {line}"
+                raise SyntaxError(msg.format(**locals()))
+            while len(path) >= level:
+                states.pop()
+                if len(path) <= entered:
+                    yield ("exit", path)
+                    entered = len(path) - 1
+                path = path[:-1]
+            state = states[-1]
+            path += (section_name,)
+            if state == "some":
+                dotted = ".".join(path)
+                if any(fnmatch.fnmatchcase(dotted, pattern)
+                       for pattern in only):
+                    state = "all"
+                elif not any((dotted + ".").startswith(prefix) or
+                             prefix.startswith(dotted + ".")
+                             for prefix in prefixes):
+                    state = "none"
+            states.append(state)
+            if state == "all":
+                for depth in range(entered + 1, len(path) + 1):
+                    yield ("enter", path[:depth])
+                entered = len(path)
+        elif kind == "option":
+            if state == "none":
+                continue
+            if state == "some":
+                result = _OPTION_NAME.match(text)
+                if result is not None:
+                    dotted = ".".join(path + (result.group(1),))
+                    if not any(fnmatch.fnmatchcase(dotted, pattern)
+                               for pattern in only):
+                        continue
+            option_name, node, source = _acp_parse_option(text, line)
+            for depth in range(entered + 1, len(path) + 1):
+                yield ("enter", path[:depth])
+            entered = len(path)
+            yield ("option", path, option_name, node, source)
+        elif state == "all":
+            if kind == "comment":
+                yield ("comment", path, text)
+            else:
+                yield ("empty", path)
+    while path:
+        if len(path) <= entered:
+            yield ("exit", path)
+            entered = len(path) - 1
+        path = path[:-1]
+
+async def parse_file_async(filename, compiled=False, compact=False,
+                           executor=None):
+    """
+    read and parse the file in executor so that the event loop is not
+    blocked. executor defaults to the default executor of the loop. a
+    ProcessPoolExecutor also keeps the parsing from competing with the
+    loop for the GIL.
+    see parse_stream() for compiled and compact.
+    """
+    import asyncio
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, parse_file, filename,
+                                      compiled, compact)
+
+async def parse_stream_async(stream, compiled=False, compact=False,
+                             executor=None):
+    """
+    read the stream in large chunks with "await stream.read(n)", like
+    from an asyncio.StreamReader, and parse it in executor.
+    the stream may yield bytes, which are utf-8 decoded, or str.
+    see parse_file_async() for executor.
+    """
+    import asyncio
+    chunks = []
+    while True:
+        chunk = await stream.read(_READ_SIZE)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    source = chunks[0][:0].join(chunks) if chunks else ""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, _acp_parse_source, source,
+                                      compiled, compact)
+
+def _acp_parse_source(source, compiled, compact):
+    if isinstance(source, bytes):
+        source = source.decode("utf-8")
+    return parse_string(source, compiled, compact)
+
+def _acp_iter_lines(stream):
+    """
+    split the stream into logical lines.
+    yields 3-tuples (kind, line number, stripped text) where kind is one of
+    "empty", "comment", "section" or "option". options spanning several
+    physical lines are joined and reported with their first line number.
+    """
+    lines = _acp_read_lines(stream)
+    line = 0
+    for raw in lines:
+        line += 1
+        # strip() returns the line itself if there is nothing to strip
+        text = raw.strip()
+        if not text:
+            yield "empty", line, text
+            continue
+        first = text[0]
+        if first == "#":
+            yield "comment", line, text
+        elif first == "[":
+            yield "section", line, text
+        else:
+            # find the end of the logical line before parsing it once
+            first_line = line
+            depth, quote, continued = _acp_scan_line(raw)
+            if continued:
+                parts = [raw]
+                while continued:
+                    raw = next(lines, None)
+                    if raw is None:
+                        break
+                    line += 1
+                    parts.append(raw)
+                    depth, quote, continued = _acp_scan_line(raw, depth,
+                                                             quote)
+                text = "\n".join(parts).strip()
+            yield "option", first_line, text
+
+def _acp_read_lines(stream):
+    """
+    yields the physical lines of the stream without their line breaks.
+    the stream is read in blocks of _READ_SIZE characters.
+    """
+    rest = ""
+    while True:
+        block = stream.read(_READ_SIZE)
+        if not block:
+            break
+        lines = block.split("\n")
+        lines[0] = rest + lines[0]
+        rest = lines.pop()
+        for raw in lines:
+            yield raw
+    if rest:
+        yield rest
+
+def _acp_parse_header(text, line):
+    """
+    returns the nesting level and the name of a section header.
+    """
+    result = _SECTION_HEADER.match(text)
+    if result is None:
+        msg = "malformed section header in line {line}:\n{text}"
+        raise SyntaxError(msg.format(**locals()))
+    if len(result.group(1)) != len(result.group(3)):
+        msg = "section braket mismatch in line {line}:\n{text}"
+        raise SyntaxError(msg.format(**locals()))
+    level = min(len(result.group(1)), len(result.group(3)))
+    section_name = ast.parse(result.group(2)).body[0].value.id
+    return level, section_name
+
+def _acp_parse_option(text, line):
+    """
+    returns the name, the ast-node of the value and the source text of
+    the value of an option.
+    """
+    try:
+        node = ast.parse(text)
+    except SyntaxError as e:
+        msg = "invalid option in line {line}: {e.msg}\n{text}"
+        raise SyntaxError(msg.format(**locals()))
+    node = node.body[0]
+    assert isinstance(node, ast.Assign)
+    result = _OPTION_NAME.match(text)
+    source = text[result.end():].strip() if result is not None else None
+    return node.targets[0].id, node.value, source
+
+def reload_file(root, filename, compiled=False, compact=False):
+    with open(filename) as f:
+        return reload_stream(root, f, compiled, compact)
+
+def reload_string(root, s, compiled=False, compact=False):
+    return reload_stream(root, io.StringIO(s), compiled, compact)
+
+def reload_stream(root, stream, compiled=False, compact=False):
+    """
+    update the tree of a previous parse in place to match the stream.
+    only options whose source text changed are parsed again.
+    changed values are set through LazyEval.__set__ and new or removed
+    children go through _acp_add_child() and _acp_remove_child() so only
+    the cached values depending on them are invalidated.
+    compiled and compact apply to new and changed options like in
+    parse_stream().
+    returns the dotted paths of all added, changed and removed sections
+    and options.
+    errors in the stream are raised before the tree is modified.
+    """
+    if root.__dict__["_acp_frozen"]:
+        raise AttributeError("can not reload a frozen section")
+    # work out all changes first. plan maps the path of every section in
+    # the stream to its new order and its options as (name, source, node)
+    # where node is None for unchanged options.
+    plan = {(): ([], [])}
+    paths = [()]
+    existing = [root]
+    for kind, line, text in _acp_iter_lines(stream):
+        order, options = plan[paths[-1]]
+        if kind == "empty":
+            order.append("\n")
+        elif kind == "comment":
+            order.append(text)
+        elif kind == "section":
+            level, section_name = _acp_parse_header(text, line)
+            if level > len(paths):
+                msg = "wrong section nesting in line {line}"
+                raise SyntaxError(msg.format(**locals()))
+            del paths[level:]
+            del existing[level:]
+            path = paths[-1] + (section_name,)
+            if path in plan:
+                msg = 'duplicate section "{section_name}".'.format(**locals())
+                raise SyntaxError(msg)
+            plan[paths[-1]][0].append(section_name)
+            plan[path] = ([], [])
+            paths.append(path)
+            parent = existing[-1]
+            if parent is not None:
+                parent = parent._acp_get_section(section_name)
+            existing.append(parent)
+        else:
+            section = existing[-1]
+            result = _OPTION_NAME.match(text)
+            option = None
+            if section is not None and result is not None:
+                option = section._acp_get_option(result.group(1))
+            if (option is not None and option._acp_source is not None and
+                    option._acp_source == text[result.end():].strip()):
+                name, node, source = option._acp_name, None, option._acp_source
+            else:
+                name, node, source = _acp_parse_option(text, line)
+                if option is not None and option._acp_defined_as(node):
+                    node = None
+                elif ((compiled or option is not None and
+                       option._acp_code is not None) and
+                      not (compact and _acp_is_literal(node))):
+                    # unsupported nodes must fail before the tree changes
+                    LazyEval._acp_compile(node)
+            if name in order:
+                msg = 'duplicate option "{name}" in section "{path}".'
+                raise SyntaxError(msg.format(name=name,
+                                             path=".".join(paths[-1])))
+            order.append(name)
+            options.append((name, source, node))
+    for path in plan:
+        section = root._acp_get_descendant(path)
+        if section is not None and section.__dict__["_acp_frozen"]:
+            msg = 'can not reload frozen section "{path}"'
+            raise AttributeError(msg.format(path=".".join(path)))
+
+    with _GRAPH_LOCK:
+        changed = []
+        # drop what is gone first so that the names are free for new children
+        for path, (order, options) in plan.items():
+            section = root._acp_get_descendant(path)
+            if section is None:
+                continue
+            keep = set(name for name, source, node in options)
+            for name in list(section._acp_option_names()):
+                if name not in keep:
+                    section._acp_remove_child(name)
+                    changed.append(".".join(path + (name,)))
+            for name in list(section._acp_section_names()):
+                if path + (name,) not in plan:
+                    section._acp_remove_child(name)
+                    changed.append(".".join(path + (name,)))
+        # then add and update in the order of the stream. sections always
+        # come after their parent in plan.
+        for path, (order, options) in plan.items():
+            section = root._acp_get_descendant(path)
+            if section is None:
+                section = Section()
+                section._acp_name = path[-1]
+                root._acp_get_descendant(path[:-1])._acp_add_child(section)
+                changed.append(".".join(path))
+            for name, source, node in options:
+                option = section._acp_get_option(name)
+                if option is None:
+                    option = Option()
+                    option._acp_name = name
+                    option._acp_define(node, source, compiled, compact)
+                    section._acp_add_child(option)
+                    changed.append(".".join(path + (name,)))
+                elif node is not None:
+                    option._acp_define(node, source, compiled, compact)
+                    changed.append(".".join(path + (name,)))
+                elif not compact:
+                    option._acp_source = source
+            section.__dict__["_acp_order"][:] = order
+    return changed
+
+def attach_snapshot(source):
+    """
+    returns a read-only Snapshot of what Section.export_snapshot() wrote.
+    source is the name of a snapshot file or a bytes-like object such as
+    the buffer of a multiprocessing.shared_memory.SharedMemory.
+    files are mapped into memory so processes attaching to the same file
+    share its pages. nothing is evaluated or copied up front.
+    """
+    if isinstance(source, str):
+        import mmap
+        with open(source, "rb") as f:
+            source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    buffer = memoryview(source)
+    if len(buffer) < _SNAPSHOT_HEADER.size:
+        raise RuntimeError("not a config snapshot")
+    magic, format, count = _SNAPSHOT_HEADER.unpack_from(buffer)
+    if magic != _SNAPSHOT_MAGIC or format != _SNAPSHOT_FORMAT:
+        raise RuntimeError("not a config snapshot")
+    return Snapshot(buffer, count)
+
+def _acp_pack_ast(node):
+    """
+    turn ast-nodes into nested tuples of their class and fields.
+    source positions are dropped.
+    """
+    if isinstance(node, ast.AST):
+        return (node.__class__,) + tuple(_acp_pack_ast(getattr(node, field,
+                                                              None))
+                                         for field in node._fields)
+    elif isinstance(node, list):
+        return [_acp_pack_ast(child) for child in node]
+    return node
+
+def _acp_unpack_ast(packed):
+    """
+    inverse of _acp_pack_ast().
+    """
+    if isinstance(packed, list):
+        return [_acp_unpack_ast(child) for child in packed]
+    elif (isinstance(packed, tuple) and packed and
+          isinstance(packed[0], type) and issubclass(packed[0], ast.AST)):
+        return packed[0](*[_acp_unpack_ast(child) for child in packed[1:]])
+    return packed
+
+def _acp_path(obj):
+    """
+    returns the dotted path of a section or option starting at the root.
+    """
+    names = []
+    while obj._acp_parent is not None:
+        names.append(obj._acp_name)
+        obj = obj._acp_parent
+    return ".".join(reversed(names))
+
 class Section(object):
     """
     Section objects allow access to their sub-sections and options via
@@ -154,12 +901,24 @@ class Section(object):
         self.__dict__["_acp_parent"] = None
         self.__dict__["_acp_order"] = []
         self.__dict__["_acp_nesting_level"] = 0
+        self.__dict__["_acp_frozen"] = False
+        # child sections and options by name in the order they were added
+        self.__dict__["_acp_section_registry"] = {}
+        self.__dict__["_acp_option_registry"] = {}
+        # maps references used in this section to _Reference entries
+        self.__dict__["_acp_ref_index"] = {}
+        # maps names looked up in this section to the (section, reference)
+        # index entries whose resolution depends on that child
+        self.__dict__["_acp_ref_watchers"] = {}
 
     def __str__(self):
         return '<Section "{self._acp_name}">'.format(**locals())
     __repr__ = __str__
 
     def __setattr__(self, attr, val):
+        if self.__dict__["_acp_frozen"]:
+            msg = 'can not set "{attr}" on frozen section "{self._acp_name}"'
+            raise AttributeError(msg.format(**locals()))
         obj = object.__getattribute__(self, attr)
         if isinstance(obj, Option):
             obj._acp_value = val
@@ -179,15 +938,209 @@ class Section(object):
         except AttributeError as e:
             raise KeyError(str(e))
 
+    def __getstate__(self):
+        # the reference index is rebuilt on demand after unpickling
+        state = self.__dict__.copy()
+        state["_acp_ref_index"] = {}
+        state["_acp_ref_watchers"] = {}
+        # an unpickled overlay no longer follows its layers
+        state.pop("_acp_layers", None)
+        state.pop("_acp_overlays", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
     def _acp_add_child(self, child):
-        child._acp_nesting_level = self._acp_nesting_level + 1
+        state = self.__dict__
+        if state["_acp_frozen"]:
+            msg = ('can not add "{child._acp_name}" to frozen section '
+                   '"{self._acp_name}"')
+            raise AttributeError(msg.format(**locals()))
+        name = child._acp_name
+        child._acp_nesting_level = state["_acp_nesting_level"] + 1
         if child._acp_parent is None:
             child._acp_parent = self
-        if child._acp_name in self.__dict__:
-            msg = "duplicate object: {child_name}"
-            raise SyntaxError(msg.format(child_name=child._acp_name))
-        self.__dict__[child._acp_name] = child
-        self.__dict__["_acp_order"].append(child._acp_name)
+        with _GRAPH_LOCK:
+            if name in state:
+                msg = "duplicate object: {name}"
+                raise SyntaxError(msg.format(**locals()))
+            state[name] = child
+            state["_acp_order"].append(name)
+            if isinstance(child, Section):
+                state["_acp_section_registry"][name] = child
+            else:
+                state["_acp_option_registry"][name] = child
+            # the new child may shadow what references resolved to so far
+            if state["_acp_ref_watchers"]:
+                self._acp_notify_watchers(name)
+            if state.get("_acp_overlays"):
+                self._acp_notify_overlays(name)
+
+    def _acp_remove_child(self, name):
+        """
+        remove the sub-section or option called name.
+        everything that was computed from it is invalidated.
+        """
+        if self.__dict__["_acp_frozen"]:
+            msg = ('can not remove "{name}" from frozen section '
+                   '"{self._acp_name}"')
+            raise AttributeError(msg.format(**locals()))
+        with _GRAPH_LOCK:
+            child = self._acp_get_child(name)
+            if child is None:
+                msg = 'no child "{name}" in section "{self._acp_name}"'
+                raise AttributeError(msg.format(**locals()))
+            del self.__dict__[name]
+            if isinstance(child, Section):
+                del self.__dict__["_acp_section_registry"][name]
+                options = [option for section in child._acp_walk_sections()
+                           for option in section._acp_options()]
+            else:
+                del self.__dict__["_acp_option_registry"][name]
+                options = [child]
+            order = self.__dict__["_acp_order"]
+            if name in order:
+                order.remove(name)
+            child._acp_parent = None
+            self._acp_notify_watchers(name)
+            for option in options:
+                Option._acp_value._acp_invalidate(option)
+            if self.__dict__.get("_acp_overlays"):
+                self._acp_notify_overlays(name)
+
+    def _acp_link_child(self, child):
+        # add child to the registries of this section but not to its order
+        state = self.__dict__
+        if isinstance(child, Section):
+            state["_acp_section_registry"][child._acp_name] = child
+        else:
+            state["_acp_option_registry"][child._acp_name] = child
+        child._acp_parent = self
+        child._acp_nesting_level = state["_acp_nesting_level"] + 1
+        state[child._acp_name] = child
+
+    def _acp_notify_overlays(self, name):
+        # copy as the overlays may be dropped while they are updated
+        for overlay in list(self.__dict__["_acp_overlays"]):
+            if not overlay.__dict__["_acp_frozen"]:
+                overlay._acp_relink(name)
+
+    def _acp_relink(self, name):
+        """
+        update the child called name of an overlay after it was added to
+        or removed from one of its layers. children set or added through
+        the overlay itself are kept.
+        """
+        children = [layer._acp_get_child(name)
+                    for layer in self.__dict__["_acp_layers"]]
+        children = [child for child in children if child is not None]
+        current = self._acp_get_child(name)
+        if isinstance(current, Option):
+            if current._acp_origin is None:
+                return
+            if children and children[-1] is current._acp_origin:
+                return
+        elif current is not None:
+            state = object.__getattribute__(current, "__dict__")
+            if current.__class__ is Overlay:
+                layers = state["_acp_lazy"]
+            else:
+                layers = state.get("_acp_layers")
+            if layers is None:
+                return
+            sections = []
+            for child in reversed(children):
+                if not isinstance(child, Section):
+                    break
+                sections.insert(0, child)
+            if sections and sections == list(layers):
+                return
+        order = self.__dict__["_acp_order"]
+        position = order.index(name) if name in order else len(order)
+        if current is not None:
+            self._acp_remove_child(name)
+        if children:
+            self._acp_add_child(_acp_overlay_child(children))
+            order.insert(position, order.pop())
+
+    def _acp_merge(self, other):
+        """
+        move the children of the section other into this section.
+        options replace those of the same name in their position and
+        sub-sections of the same name are merged recursively. new children,
+        comments and empty lines are appended.
+        """
+        order = self.__dict__["_acp_order"]
+        for name in other.__dict__["_acp_order"]:
+            child = other._acp_get_child(name)
+            if child is None:
+                order.append(name)
+                continue
+            existing = self._acp_get_child(name)
+            if isinstance(child, Section) and isinstance(existing, Section):
+                existing._acp_merge(child)
+                continue
+            child._acp_parent = None
+            if existing is None:
+                self._acp_add_child(child)
+                continue
+            position = order.index(name)
+            self._acp_remove_child(name)
+            self._acp_add_child(child)
+            order.remove(name)
+            order.insert(position, name)
+
+    def _acp_notify_watchers(self, name):
+        """
+        drop the index entries that looked up name in this section.
+        callers hold _GRAPH_LOCK.
+        """
+        watchers = self.__dict__["_acp_ref_watchers"].pop(name, ())
+        for section, ref in watchers:
+            reference = section.__dict__["_acp_ref_index"].pop(ref, None)
+            if reference is not None:
+                Option._acp_value._acp_invalidate(reference)
+
+    def _acp_resolve(self, ref):
+        """
+        returns the _Reference a dotted reference resolves to when used
+        in this section or None if no enclosing scope has a match.
+        """
+        index = self.__dict__["_acp_ref_index"]
+        reference = index.get(ref)
+        if reference is None:
+            with _GRAPH_LOCK:
+                reference = index.get(ref)
+                if reference is None:
+                    reference = self._acp_index_reference(ref)
+                    if reference is not None:
+                        index[ref] = reference
+        return reference
+
+    def _acp_index_reference(self, ref):
+        """
+        walk up the tree to find the closest scope containing ref.
+        every section on the way is told to drop the index entry once a
+        child of the looked up name is added or removed.
+        """
+        attrs = ref.split(".")
+        scope = self
+        while scope is not None:
+            obj = scope
+            for i, attr in enumerate(attrs):
+                watchers = obj.__dict__["_acp_ref_watchers"]
+                watchers.setdefault(attr, set()).add((self, ref))
+                child = obj._acp_get_child(attr)
+                if child is None:
+                    break
+                obj = child
+                if isinstance(obj, Option):
+                    return _Reference(scope, obj, tuple(attrs[i + 1:]))
+            else:
+                return _Reference(scope, obj, ())
+            scope = scope._acp_parent
+        return None
 
     def _acp_add_empty_line(self):
         self.__dict__["_acp_order"].append("\n")
@@ -195,102 +1148,652 @@ class Section(object):
     def _acp_add_comment(self, comment):
         self.__dict__["_acp_order"].append(comment)
 
+    def _acp_get_child(self, name):
+        """
+        returns the sub-section or option called name or None.
+        """
+        child = self.__dict__["_acp_section_registry"].get(name)
+        if child is None:
+            child = self.__dict__["_acp_option_registry"].get(name)
+        return child
+
+    def _acp_get_section(self, name):
+        return self.__dict__["_acp_section_registry"].get(name)
+
+    def _acp_get_option(self, name):
+        return self.__dict__["_acp_option_registry"].get(name)
+
+    def _acp_get_descendant(self, path):
+        """
+        returns the sub-section at the path of section names or None.
+        """
+        section = self
+        for name in path:
+            section = section._acp_get_section(name)
+            if section is None:
+                break
+        return section
+
+    def _acp_has_section(self, name):
+        return name in self.__dict__["_acp_section_registry"]
+
+    def _acp_has_option(self, name):
+        return name in self.__dict__["_acp_option_registry"]
+
     def _acp_sections(self):
-        for section in (section for section in self.__dict__.values()
-                        if isinstance(section, Section)):
-            yield section
+        return iter(self.__dict__["_acp_section_registry"].values())
     def _acp_section_names(self):
-        for section_name in (sn for (sn, s) in self.__dict__.items()
-                             if isinstance(s, Section)):
-            yield section_name
+        return iter(self.__dict__["_acp_section_registry"])
 
     def _acp_options(self):
-        for option in (option for option in self.__dict__.values()
-                       if isinstance(option, Option)):
-            yield option
+        return iter(self.__dict__["_acp_option_registry"].values())
     def _acp_option_names(self):
-        for option_name in (o_name for o_name, option in self.__dict__.items()
-                            if isinstance(option, Option)):
-            yield option_name
+        return iter(self.__dict__["_acp_option_registry"])
 
     def _acp_children(self):
-        for child in (child for child in self.__dict__.values()
-                      if isinstance(child, (Section, Option))):
-            yield child
+        sections = self.__dict__["_acp_section_registry"]
+        options = self.__dict__["_acp_option_registry"]
+        for name in self.__dict__["_acp_order"]:
+            if name in sections:
+                yield sections[name]
+            elif name in options:
+                yield options[name]
+
+    def clear_cache(self):
+        """
+        forget all evaluated values and resolved references in this section
+        and its sub-sections. they are recomputed on their next access.
+        """
+        invalidate = Option._acp_value._acp_invalidate
+        with _GRAPH_LOCK:
+            for section in self._acp_walk_sections():
+                index = section.__dict__["_acp_ref_index"]
+                for reference in index.values():
+                    invalidate(reference)
+                index.clear()
+                for option in section._acp_options():
+                    invalidate(option)
+
+    def resolve_all(self):
+        """
+        evaluate every option in this section and its sub-sections once.
+        each option is evaluated after the options it refers to.
+        a RuntimeError naming the options involved is raised for reference
+        cycles. cycles among the references written in the options are
+        only reported if evaluating them runs into the cycle, since they
+        may pass through branches of conditionals that are not taken.
+        """
+        order, cycles = self._acp_dependency_order()
+        for option in order:
+            try:
+                option._acp_value
+            except RuntimeError:
+                if option not in cycles:
+                    raise
+                raise RuntimeError(cycles[option])
+
+    def freeze(self):
+        """
+        evaluate all options via resolve_all() and replace them with their
+        values so that reading them is a plain attribute lookup.
+        the frozen section and its sub-sections can not be changed anymore.
+        """
+        self.resolve_all()
+        # evaluate outside of the lock as evaluations may wait for others
+        values = [(section, [(name, option._acp_value) for name, option in
+                             section.__dict__["_acp_option_registry"].items()])
+                  for section in self._acp_walk_sections()]
+        with _GRAPH_LOCK:
+            for section, options in values:
+                for name, value in options:
+                    section.__dict__[name] = value
+                section.__dict__["_acp_frozen"] = True
+
+    def extract(self, keys, schema=None, typename=None):
+        """
+        returns the values of the dotted keys relative to this section in a
+        dict. sections and options met on the way are looked up once for
+        all keys sharing them.
+        schema optionally maps keys to callables converting their values,
+        e.g. int or float.
+        if typename is given a namedtuple of that name is returned instead
+        whose fields are the keys with dots replaced by underscores.
+        a KeyError is raised for keys that can not be found.
+        """
+        values = {}
+        found = {}
+        for key in keys:
+            obj = self
+            prefix = None
+            for attr in key.split("."):
+                prefix = attr if prefix is None else prefix + "." + attr
+                if prefix in found:
+                    obj = found[prefix]
+                    continue
+                if isinstance(obj, Section):
+                    obj = obj._acp_get_child(attr)
+                    if obj is None:
+                        raise KeyError(key)
+                    if isinstance(obj, Option):
+                        obj = obj._acp_value
+                else:
+                    try:
+                        obj = getattr(obj, attr)
+                    except AttributeError:
+                        raise KeyError(key)
+                found[prefix] = obj
+            if schema is not None and key in schema:
+                obj = schema[key](obj)
+            values[key] = obj
+        if typename is None:
+            return values
+        fields = tuple(key.replace(".", "_") for key in values)
+        cls = _EXTRACT_TYPES.get((typename, fields))
+        if cls is None:
+            cls = collections.namedtuple(typename, fields)
+            _EXTRACT_TYPES[(typename, fields)] = cls
+        return cls(*values.values())
+
+    def to_dict(self, recursive=True):
+        """
+        returns the values of all options of this section in a dict in the
+        order they were added.
+        sub-sections are converted to nested dicts if recursive is True and
+        included as Section objects otherwise.
+        """
+        result = {}
+        pending = [(self, result)]
+        while pending:
+            section, values = pending.pop()
+            for child in section._acp_children():
+                if isinstance(child, Option):
+                    values[child._acp_name] = child._acp_value
+                elif recursive:
+                    values[child._acp_name] = {}
+                    pending.append((child, values[child._acp_name]))
+                else:
+                    values[child._acp_name] = child
+        return result
+
+    def export_snapshot(self, filename=None):
+        """
+        evaluate all options via resolve_all() and return their values
+        together with the sub-sections as bytes in a flat binary layout.
+        if filename is given the bytes are written to that file as well.
+        attach_snapshot() gives attribute access to them.
+        """
+        import pickle
+        self.resolve_all()
+        entries = []
+        pending = [("", self)]
+        while pending:
+            prefix, section = pending.pop()
+            sections = section.__dict__["_acp_section_registry"]
+            for name, child in sections.items():
+                entries.append(((prefix + name).encode("utf-8"), None))
+                pending.append((prefix + name + ".", child))
+            options = section.__dict__["_acp_option_registry"]
+            for name, option in options.items():
+                value = pickle.dumps(option._acp_value,
+                                     pickle.HIGHEST_PROTOCOL)
+                entries.append(((prefix + name).encode("utf-8"), value))
+        entries.sort(key=lambda entry: entry[0])
+        offset = _SNAPSHOT_HEADER.size + len(entries) * _SNAPSHOT_ENTRY.size
+        table = [_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, _SNAPSHOT_FORMAT,
+                                       len(entries))]
+        data = []
+        for key, value in entries:
+            is_section = value is None
+            if is_section:
+                value = b""
+            table.append(_SNAPSHOT_ENTRY.pack(offset, len(key),
+                                              offset + len(key), len(value),
+                                              is_section))
+            data.append(key)
+            data.append(value)
+            offset += len(key) + len(value)
+        snapshot = b"".join(table + data)
+        if filename is not None:
+            tmp_filename = "{0}.{1}.tmp".format(filename, os.getpid())
+            with open(tmp_filename, "wb") as f:
+                f.write(snapshot)
+            os.replace(tmp_filename, filename)
+        return snapshot
+
+    def fold_constants(self):
+        """
+        replace the sub-expressions without references in the options of
+        this section and its sub-sections by their constant values once
+        so that evaluating them touches fewer ast-nodes. constants that
+        could get large are not folded.
+        values and cached results stay the same and so does the dumped
+        source text unless it was not kept as with compact=True.
+        """
+        for section in self._acp_walk_sections():
+            for option in section._acp_options():
+                node = option._acp_ast_node
+                if node is None:
+                    continue
+                option._acp_ast_node = _acp_fold(node)
+                if option._acp_code is not None:
+                    option._acp_compile()
+
+    def _acp_evaluate_static(self):
+        """
+        evaluate the options without references in this section and its
+        sub-sections. options that fail to evaluate are left alone and
+        raise their error when accessed.
+        """
+        for section in self._acp_walk_sections():
+            for option in section._acp_options():
+                if (option._acp_is_cached() or
+                        next(LazyEval._acp_references(option._acp_ast_node),
+                             None) is not None):
+                    continue
+                try:
+                    option._acp_value
+                except Exception:
+                    pass
+
+    def _acp_walk_sections(self):
+        """
+        yields this section and all its sub-sections.
+        """
+        pending = [self]
+        while pending:
+            section = pending.pop()
+            yield section
+            pending.extend(section._acp_sections())
+
+    def _acp_dependency_order(self):
+        """
+        returns the options of this section and its sub-sections together
+        with the options they refer to in topological order and a dict
+        mapping the options on reference cycles to a description of the
+        cycle. references closing a cycle are left out of the order.
+        """
+        order = []
+        cycles = {}
+        visiting, done = 1, 2
+        state = {}
+        for section in self._acp_walk_sections():
+            for start in section._acp_options():
+                if start in state:
+                    continue
+                state[start] = visiting
+                stack = [(start, iter(start._acp_dependencies()))]
+                while stack:
+                    option, dependencies = stack[-1]
+                    for dependency in dependencies:
+                        if dependency not in state:
+                            state[dependency] = visiting
+                            dependencies = dependency._acp_dependencies()
+                            stack.append((dependency, iter(dependencies)))
+                            break
+                        elif state[dependency] == visiting:
+                            cycle = [entry[0] for entry in stack]
+                            cycle = cycle[cycle.index(dependency):]
+                            msg = "reference cycle: " + " -> ".join(
+                                _acp_path(entry)
+                                for entry in cycle + [dependency])
+                            for entry in cycle:
+                                cycles.setdefault(entry, msg)
+                    else:
+                        stack.pop()
+                        state[option] = done
+                        order.append(option)
+        return order, cycles
 
     def dump(self):
         return self.pretty_print(do_indent=False)
 
+    def dump_to(self, stream):
+        """
+        write what dump() returns to the file-like object stream line by
+        line without building the whole string.
+        """
+        write = stream.write
+        for line in self._acp_dump_lines(do_indent=False):
+            write(line)
+
     def pretty_print(self, indent=0, do_indent=True):
+        return "".join(self._acp_dump_lines(indent, do_indent))
+
+    def _acp_dump_lines(self, indent=0, do_indent=True):
+        """
+        yields the lines of pretty_print() one by one.
+        sub-sections are walked with a stack instead of recursion and are
+        always indented.
+        """
         if self._acp_name != "<global>":
-            template = "{indentation}{left}{section_name}{right}\n"
-            s = template.format(indentation=" " * indent,
-                                left="[" * self._acp_nesting_level,
-                                right="]" * self._acp_nesting_level,
-                                section_name=self._acp_name)
+            yield self._acp_header_line(indent)
             if do_indent:
                 indent += 1
-        else:
-            s = ""
-        for child_name in self._acp_order:
-            if child_name == "\n":
-                s += "\n"
-            elif child_name.strip().startswith("#"):
-                s += "{indent}{comment}\n".format(indent=" " * indent,
-                                                  comment=child_name)
-            else:
-                child = getattr(self, child_name)
-                if isinstance(child, Section):
-                    s += child.pretty_print(indent)
+        stack = [(self, iter(self.__dict__["_acp_order"]), indent)]
+        while stack:
+            section, names, indent = stack[-1]
+            for name in names:
+                if name == "\n":
+                    yield "\n"
+                elif name.strip().startswith("#"):
+                    yield "{indent}{comment}\n".format(indent=" " * indent,
+                                                       comment=name)
                 else:
-                    child_raw = self._acp_get_raw_option(child_name)
+                    child = section._acp_get_section(name)
+                    if child is not None:
+                        yield child._acp_header_line(indent)
+                        stack.append((child, iter(child.__dict__["_acp_order"]),
+                                      indent + 1))
+                        break
                     template = "{indentation}{option_name} = {option_raw}\n"
-                    s += template.format(indentation=" " * indent,
-                                         option_name=child_name,
-                                         option_raw=child_raw)
-        return s
+                    yield template.format(
+                        indentation=" " * indent, option_name=name,
+                        option_raw=section._acp_get_raw_option(name))
+            else:
+                stack.pop()
+
+    def _acp_header_line(self, indent):
+        template = "{indentation}{left}{section_name}{right}\n"
+        return template.format(indentation=" " * indent,
+                               left="[" * self._acp_nesting_level,
+                               right="]" * self._acp_nesting_level,
+                               section_name=self._acp_name)
 
     def _acp_get_raw_option(self, option_name):
-        return self.__getattribute__(option_name, True)._acp_raw_value
+        option = self.__dict__["_acp_option_registry"][option_name]
+        return option._acp_raw_value
+
+class _LazySection(Section):
+    """
+    top-level section made by parse_file(lazy=True) whose content is parsed
+    from its part of the file on the first access to anything but its
+    name and position in the tree. it turns into a plain Section then.
+    """
+    def __init__(self, name, source, start, end, line, compiled, compact):
+        super(_LazySection, self).__init__()
+        state = object.__getattribute__(self, "__dict__")
+        state["_acp_name"] = name
+        state["_acp_lazy"] = (source, start, end, line, compiled, compact)
+
+    def __getattribute__(self, attr, raw=False):
+        if attr not in _LAZY_ATTRIBUTES:
+            _LazySection._acp_load(self)
+        return Section.__getattribute__(self, attr, raw)
+
+    def __setattr__(self, attr, val):
+        if attr in _LAZY_ATTRIBUTES:
+            object.__setattr__(self, attr, val)
+        else:
+            _LazySection._acp_load(self)
+            Section.__setattr__(self, attr, val)
+
+    def _acp_load(self):
+        state = object.__getattribute__(self, "__dict__")
+        with _GRAPH_LOCK:
+            lazy = state.pop("_acp_lazy", None)
+            if lazy is None:
+                # loaded by another thread or still being initialized
+                return
+            try:
+                type(self)._acp_fill(self, state, lazy)
+            except BaseException:
+                state["_acp_lazy"] = lazy
+                raise
+            object.__setattr__(self, "__class__", Section)
+
+    def _acp_fill(self, state, lazy):
+        """
+        set up the content of the section in its __dict__ state from what
+        was stored as "_acp_lazy".
+        """
+        source, start, end, line, compiled, compact = lazy
+        filename, mtime, size, encoding = source
+        with open(filename, "rb") as f:
+            stat = os.fstat(f.fileno())
+            if (stat.st_mtime_ns, stat.st_size) != (mtime, size):
+                msg = ('can not load section "{name}" because "{filename}" '
+                       'changed since it was parsed')
+                raise RuntimeError(msg.format(name=state["_acp_name"],
+                                              filename=filename))
+            f.seek(start)
+            text = f.read(end - start).decode(encoding)
+        # pad with empty lines so that errors report the line in the file
+        parsed = parse_string("\n" * (line - 1) + text, compiled, compact)
+        content = parsed._acp_get_section(state["_acp_name"]).__dict__
+        for name in ("_acp_order", "_acp_section_registry",
+                     "_acp_option_registry"):
+            state[name] = content[name]
+        for registry in ("_acp_section_registry", "_acp_option_registry"):
+            for name, child in content[registry].items():
+                state[name] = child
+                child._acp_parent = self
+
+
+class Overlay(_LazySection):
+    """
+    combined view of several trees stacked on top of each other like
+    Overlay(base, override, ...). children of later layers hide those of
+    the same name in earlier layers and sub-sections of the same name are
+    overlaid in turn. references are resolved in the combined view.
+    like a lazy section an overlay is set up on the first access to its
+    content and turns into a plain Section then. its options share the
+    ast-nodes of the layers but cache their own values, so the layers
+    are never modified through the overlay and can be shared by many
+    overlays.
+    the overlay follows later changes of the layers: options set in a
+    layer and children added to or removed from a layer show through,
+    unless the overlay has set or added a child of that name itself.
+    comments and empty lines are taken from the first layer only.
+    """
+    def __init__(self, *layers):
+        Section.__init__(self)
+        state = object.__getattribute__(self, "__dict__")
+        state["_acp_name"] = layers[0]._acp_name
+        state["_acp_lazy"] = layers
+
+    def _acp_fill(self, state, layers):
+        # the children of every name in the order they first appear
+        candidates = collections.OrderedDict()
+        for index, layer in enumerate(layers):
+            for name in layer.__dict__["_acp_order"]:
+                child = layer._acp_get_child(name)
+                if child is None:
+                    if index == 0:
+                        state["_acp_order"].append(name)
+                    continue
+                if name not in candidates:
+                    candidates[name] = []
+                    state["_acp_order"].append(name)
+                candidates[name].append(child)
+        for children in candidates.values():
+            Section._acp_link_child(self, _acp_overlay_child(children))
+        state["_acp_layers"] = layers
+        for layer in layers:
+            layer.__dict__.setdefault("_acp_overlays",
+                                      weakref.WeakSet()).add(self)
+
+
+def _acp_forget(origin):
+    """
+    returns a callback removing the weak reference to a dropped overlay
+    option from the dependents of origin.
+    """
+    def forget(ref):
+        dependents = origin._acp_dependents
+        if dependents is not None:
+            dependents.discard(ref)
+    return forget
+
+
+def _acp_overlay_child(children):
+    """
+    returns the child of an overlay for the children of the same name in
+    its layers.
+    """
+    if isinstance(children[-1], Option):
+        return children[-1]._acp_proxy()
+    sections = []
+    for section in reversed(children):
+        if not isinstance(section, Section):
+            break
+        sections.insert(0, section)
+    return Overlay(*sections)
+
+
+# attributes of a _LazySection that do not load its content
+_LAZY_ATTRIBUTES = frozenset(("__class__", "_acp_name", "_acp_parent",
+                              "_acp_nesting_level"))
+
 
 class LazyEval(object):
     """
     evaluates the ast nodes lazy when used as a descriptor.
-    when we find that all involved ast-nodes are static we cache the result.
+    the result is cached in the option together with the options it was
+    computed from. when one of those options is changed all dependent
+    results are invalidated and recomputed on their next access.
+
+    a parsed tree may be shared between threads. cached values are read
+    without locking. an option that is not cached yet is evaluated by the
+    first thread asking for it while other threads wait for its result.
+    changes to options and to the tree are serialized by _GRAPH_LOCK.
+    every option and index entry they invalidate is stamped with the
+    version of the change. results computed while one of the options or
+    index entries they read changed are evaluated again instead of being
+    cached. changes to anything else do not disturb them.
     """
-    def __init__(self):
-        self.cache = {}
+    # counts the changes to options and to the tree. kept on the class so
+    # that it survives swapping the descriptor, see Instrumentation.
+    _acp_version = 0
 
     def __get__(self, instance, owner):
+        if instance is None:
+            return self
         # see if we already cached the result from a previous evaluation
-        if instance in self.cache:
-            return self.cache[instance]
-        # dynamically evaluate the ast-nodes
-        val, has_refs = self._acp_eval(instance._acp_parent,
-                                       instance._acp_ast_node)
-        # if the ast-nodes have no external references cache the result
-        if not has_refs:
-            self.cache[instance] = val
-        return val
+        val = instance._acp_cache
+        if val is not _NOT_CACHED and val.__class__ is not _Evaluation:
+            return val
+        return self._acp_evaluate(instance)
 
-    def __set__(self, instance, value):
-        # if value is a ast-node invalidate the cache
-        if isinstance(value, ast.AST):
-            instance._acp_ast_node = value
+    def _acp_evaluate(self, instance):
+        """
+        dynamically evaluate the ast-nodes and record the options they read.
+        """
+        thread = threading.get_ident()
+        while True:
+            with _GRAPH_LOCK:
+                val = instance._acp_cache
+                if val is _NOT_CACHED:
+                    evaluation = _Evaluation(thread, LazyEval._acp_version)
+                    instance._acp_cache = evaluation
+                elif val.__class__ is not _Evaluation:
+                    return val
+                else:
+                    # another evaluation of this option is in progress
+                    evaluation = None
+                    waiting = val
+                    while waiting is not None:
+                        if waiting.thread == thread:
+                            msg = "reference cycle through option {path}"
+                            raise RuntimeError(msg.format(
+                                path=_acp_path(instance)))
+                        waiting = _WAITING.get(waiting.thread)
+                    if val.event is None:
+                        val.event = threading.Event()
+                    _WAITING[thread] = val
+            if evaluation is None:
+                val.event.wait()
+                with _GRAPH_LOCK:
+                    del _WAITING[thread]
+                continue
+            deps = set()
             try:
-                del self.cache[instance]
-            except KeyError:
-                pass
-        # else it is a static value which can be put directly into the cache
-        else:
-            self.cache[instance] = value
+                if instance._acp_code is None:
+                    val, has_refs = self._acp_eval(instance._acp_parent,
+                                                   instance._acp_ast_node, deps)
+                    instance._acp_has_refs = has_refs
+                else:
+                    val = instance._acp_code(self, instance._acp_parent, deps)
+            except BaseException:
+                with _GRAPH_LOCK:
+                    if instance._acp_cache is evaluation:
+                        instance._acp_cache = _NOT_CACHED
+                    evaluation.finish()
+                raise
+            with _GRAPH_LOCK:
+                current = instance._acp_changed <= evaluation.version and all(
+                    dep._acp_changed <= evaluation.version for dep in deps)
+                if instance._acp_cache is evaluation:
+                    if current:
+                        for dep in deps:
+                            if dep._acp_dependents is None:
+                                dep._acp_dependents = set()
+                            dep._acp_dependents.add(instance)
+                        instance._acp_cache = val
+                    else:
+                        instance._acp_cache = _NOT_CACHED
+                evaluation.finish()
+            if current:
+                return val
+
+    def __set__(self, instance, value):
+        with _GRAPH_LOCK:
+            # compile first so that the option is left as it was on errors
+            if isinstance(value, ast.AST) and instance._acp_code is not None:
+                code, has_refs = LazyEval._acp_compile(value)
+                instance._acp_code = code
+                instance._acp_has_refs = has_refs
+            # an overlay option set itself no longer follows its layer
+            instance._acp_origin = None
+            # if value is a ast-node it will be evaluated on next access
+            if isinstance(value, ast.AST):
+                instance._acp_ast_node = value
+            # else it is a static value which can be put directly into the
+            # cache
+            else:
+                instance._acp_ast_node = None
+                instance._acp_code = None
+                instance._acp_cache = value
+            instance._acp_source = None
+            # invalidated last so that overlay options following instance
+            # copy the new value
+            self._acp_invalidate(instance)
+
+    def _acp_invalidate(self, instance):
+        """
+        drop the cached value of instance and of all options depending on it.
+        static values are kept as they are not computed from anything.
+        evaluations in progress notice the change and start over.
+        """
+        with _GRAPH_LOCK:
+            LazyEval._acp_version += 1
+            pending = [instance]
+            while pending:
+                option = pending.pop()
+                if option.__class__ is weakref.ref:
+                    # an overlay option following a changed layer option
+                    option = option()
+                    if option is None:
+                        continue
+                    if option._acp_origin is not None:
+                        option._acp_follow()
+                option._acp_changed = LazyEval._acp_version
+                if (isinstance(option, Option) and option._acp_ast is not None
+                        and option._acp_cache.__class__ is not _Evaluation):
+                    option._acp_cache = _NOT_CACHED
+                if option._acp_dependents:
+                    pending.extend(option._acp_dependents)
+                    option._acp_dependents = None
 
-    def _acp_eval(self, parent, node):
+    def _acp_eval(self, parent, node, deps):
         """
         dynamically and recursively evaluate the ast-nodes.
         returns a 2-tuple. first is the actual value, second a bool indicating
-        if this ast-node has external dependencies and should not be cached.
+        if this ast-node has external references.
+        every option read while resolving a reference is added to deps.
         """
+        # constants, e.g. folded by Section.fold_constants(), are final
+        if node.__class__ is ast.Constant:
+            return node.value, False
         # first try simple conversion of literals
         try:
             return ast.literal_eval(node), False
@@ -298,86 +1801,71 @@ class LazyEval(object):
             pass
         # handle external references
         if isinstance(node, (ast.Name, ast.Attribute)):
-            ref = ""
-            while isinstance(node, ast.Attribute):
-                ref = "." + node.attr + ref
-                node = node.value
-            ref = node.id + ref
-            return self._acp_resolve_reference(ref, parent), True
-        # handle lists, tuples and dicts
-        elif isinstance(node, (ast.List, ast.Tuple, ast.Dict)):
+            ref = self._acp_reference_name(node)
+            return self._acp_resolve_reference(ref, parent, deps), True
+        # handle lists, tuples and sets
+        elif isinstance(node, (ast.List, ast.Tuple, ast.Set)):
             vals = []
             has_refs = False
             for child_node in ast.iter_child_nodes(node):
-                tmp = self._acp_eval(parent, child_node)
+                tmp = self._acp_eval(parent, child_node, deps)
                 if not tmp:
                     continue
                 vals.append(tmp[0])
-                has_refs = tmp[1]
-            if isinstance(node, ast.List):
-                return list(vals), has_refs
-            elif isinstance(node, ast.Tuple):
-                return tuple(vals), has_refs
+                has_refs |= tmp[1]
+            return _CONTAINER_TYPES[node.__class__](vals), has_refs
+        # handle dicts
+        elif isinstance(node, ast.Dict):
+            vals = {}
+            has_refs = False
+            for key_node, value_node in zip(node.keys, node.values):
+                key, key_has_refs = self._acp_eval(parent, key_node, deps)
+                value, value_has_refs = self._acp_eval(parent, value_node,
+                                                       deps)
+                vals[key] = value
+                has_refs |= key_has_refs | value_has_refs
             return vals, has_refs
         # handle the following math operators +, -, *, /, //, %, **, |, &, ^
         elif isinstance(node, ast.BinOp):
-            lhs, lhs_has_refs = self._acp_eval(parent, node.left)
-            rhs, rhs_has_refs = self._acp_eval(parent, node.right)
-            ops = {ast.Add: operator.add, ast.Sub: operator.sub,
-                   ast.Mult: operator.mul, ast.Div: operator.truediv,
-                   ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod,
-                   ast.Pow: operator.pow, ast.LShift: operator.lshift,
-                   ast.RShift: operator.rshift, ast.BitOr: operator.or_,
-                   ast.BitXor: operator.xor, ast.BitAnd: operator.and_,}
-            if node.op.__class__ in ops:
-                return (ops[node.op.__class__](lhs, rhs),
+            lhs, lhs_has_refs = self._acp_eval(parent, node.left, deps)
+            rhs, rhs_has_refs = self._acp_eval(parent, node.right, deps)
+            if node.op.__class__ in _BINARY_OPERATORS:
+                return (_BINARY_OPERATORS[node.op.__class__](lhs, rhs),
                         lhs_has_refs | rhs_has_refs)
             else:
                 msg = 'op "{op_name}" not supported yet'
                 raise SyntaxError(msg.format(op_name=str(node.op.__class__)))
         # handle calls to some selected builtin functions
         elif isinstance(node, ast.Call):
-            if node.func.id in ("abs", "all", "any", "bin", "bool", "chr",
-                                "complex", "dict", "divmod", "enumerate",
-                                "float", "hex", "int", "len", "list", "max",
-                                "min", "oct", "ord", "pow", "range", "reversed",
-                                "round", "set", "sorted", "str", "sum", "tuple",
-                                "type", "unichr", "zip", ):
+            if node.func.id in _BUILTIN_FUNCTIONS:
                 has_refs = False
                 args = []
                 for arg_node in node.args:
-                    arg, temp_has_refs = self._acp_eval(parent, arg_node)
+                    arg, temp_has_refs = self._acp_eval(parent, arg_node, deps)
                     args.append(arg)
                     has_refs |= temp_has_refs
                 kwargs = {}
                 for keyword_node in node.keywords:
-                    kwargs[keyword_node.arg], temp_has_refs = self._acp_eval(parent, keyword_node.value)
+                    kwargs[keyword_node.arg], temp_has_refs = self._acp_eval(parent, keyword_node.value, deps)
                     has_refs |= temp_has_refs
                 return (builtins.__dict__[node.func.id](*args, **kwargs),
                         has_refs)
         # handle ternary if operator
         elif isinstance(node, ast.IfExp):
-            test, test_has_refs = self._acp_eval(parent, node.test)
+            test, test_has_refs = self._acp_eval(parent, node.test, deps)
             if test:
-                result, has_refs = self._acp_eval(parent, node.body)
+                result, has_refs = self._acp_eval(parent, node.body, deps)
             else:
-                result, has_refs = self._acp_eval(parent, node.orelse)
+                result, has_refs = self._acp_eval(parent, node.orelse, deps)
             return result, has_refs | test_has_refs
         # handle compares
         elif isinstance(node, ast.Compare):
-            astOp2FuncOp = {ast.Eq: operator.eq, ast.NotEq: operator.ne,
-                            ast.Lt: operator.lt, ast.LtE: operator.le,
-                            ast.Gt: operator.gt, ast.GtE: operator.ge,
-                            ast.Is: operator.is_, ast.IsNot: operator.is_not,
-                            # don't use contains because arguments are reversed
-                            ast.In: lambda a, b: a in b,
-                            ast.NotIn: lambda a, b: a not in b}
-            left, left_has_refs = self._acp_eval(parent, node.left)
+            left, left_has_refs = self._acp_eval(parent, node.left, deps)
             has_refs = left_has_refs
             for ast_op, ast_right in zip(node.ops, node.comparators):
-                right, right_has_refs = self._acp_eval(parent, ast_right)
+                right, right_has_refs = self._acp_eval(parent, ast_right, deps)
                 has_refs |= right_has_refs
-                op = astOp2FuncOp[ast_op.__class__]
+                op = _COMPARE_OPERATORS[ast_op.__class__]
                 if op(left, right):
                     left = right
                 else:
@@ -388,14 +1876,14 @@ class LazyEval(object):
             has_refs = False
             if node.op.__class__ == ast.And:
                 for value in node.values:
-                    v, value_has_refs = self._acp_eval(parent, value)
+                    v, value_has_refs = self._acp_eval(parent, value, deps)
                     has_refs |= value_has_refs
                     if not v:
                         return False, has_refs
                 return True, has_refs
             elif node.op.__class__ == ast.Or:
                 for value in node.values:
-                    v, value_has_refs = self._acp_eval(parent, value)
+                    v, value_has_refs = self._acp_eval(parent, value, deps)
                     has_refs |= value_has_refs
                     if v:
                         return True, has_refs
@@ -408,33 +1896,650 @@ class LazyEval(object):
             raise RuntimeError("unhandled node: " + str(node))
 
     @classmethod
-    def _acp_resolve_reference(cls, ref, parent):
+    def _acp_compile(cls, node):
         """
-        resolves external references by walking up the tree
-        until we find a complete match
+        compile the ast-nodes once into a tree of closures.
+        supports the same nodes, operators and builtin functions as _acp_eval
+        but validates them up front and raises a SyntaxError for anything
+        else. returns a 2-tuple. first is a function taking
+        (evaluator, parent, deps) and returning the value, second a bool
+        indicating if this ast-node has external references.
+        """
+        # immutable literals become constants
+        if node.__class__ is ast.Constant:
+            value = node.value
+            return (lambda evaluator, parent, deps: value), False
+        try:
+            value = ast.literal_eval(node)
+        except (SyntaxError, ValueError):
+            pass
+        else:
+            if not isinstance(value, (list, tuple, dict, set)):
+                return (lambda evaluator, parent, deps: value), False
+        # handle external references
+        if isinstance(node, (ast.Name, ast.Attribute)):
+            ref = cls._acp_reference_name(node)
+            def code(evaluator, parent, deps):
+                return evaluator._acp_resolve_reference(ref, parent, deps)
+            return code, True
+        # handle lists, tuples, sets and dicts
+        elif isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+            container = _CONTAINER_TYPES[node.__class__]
+            elts, has_refs = cls._acp_compile_all(node.elts)
+            def code(evaluator, parent, deps):
+                return container([elt(evaluator, parent, deps)
+                                  for elt in elts])
+            return code, has_refs
+        elif isinstance(node, ast.Dict):
+            if None in node.keys:
+                raise SyntaxError("dict unpacking is not supported")
+            keys, keys_have_refs = cls._acp_compile_all(node.keys)
+            values, values_have_refs = cls._acp_compile_all(node.values)
+            items = list(zip(keys, values))
+            def code(evaluator, parent, deps):
+                return dict((key(evaluator, parent, deps),
+                             value(evaluator, parent, deps))
+                            for key, value in items)
+            return code, keys_have_refs | values_have_refs
+        # handle the following math operators +, -, *, /, //, %, **, |, &, ^
+        elif isinstance(node, ast.BinOp):
+            if node.op.__class__ not in _BINARY_OPERATORS:
+                msg = 'op "{op_name}" not supported yet'
+                raise SyntaxError(msg.format(op_name=str(node.op.__class__)))
+            op = _BINARY_OPERATORS[node.op.__class__]
+            lhs, lhs_has_refs = cls._acp_compile(node.left)
+            rhs, rhs_has_refs = cls._acp_compile(node.right)
+            def code(evaluator, parent, deps):
+                return op(lhs(evaluator, parent, deps),
+                          rhs(evaluator, parent, deps))
+            return code, lhs_has_refs | rhs_has_refs
+        # handle calls to some selected builtin functions
+        elif isinstance(node, ast.Call):
+            if (not isinstance(node.func, ast.Name) or
+                    node.func.id not in _BUILTIN_FUNCTIONS or
+                    node.func.id not in builtins.__dict__):
+                msg = 'call to "{func}" not supported'
+                raise SyntaxError(msg.format(func=ast.dump(node.func)))
+            func = builtins.__dict__[node.func.id]
+            args, has_refs = cls._acp_compile_all(node.args)
+            kwargs = []
+            for keyword_node in node.keywords:
+                if keyword_node.arg is None:
+                    raise SyntaxError("keyword unpacking is not supported")
+                value, value_has_refs = cls._acp_compile(keyword_node.value)
+                kwargs.append((keyword_node.arg, value))
+                has_refs |= value_has_refs
+            def code(evaluator, parent, deps):
+                return func(*[arg(evaluator, parent, deps) for arg in args],
+                            **dict((name, value(evaluator, parent, deps))
+                                   for name, value in kwargs))
+            return code, has_refs
+        # handle ternary if operator
+        elif isinstance(node, ast.IfExp):
+            (test, body, orelse), has_refs = cls._acp_compile_all(
+                (node.test, node.body, node.orelse))
+            def code(evaluator, parent, deps):
+                if test(evaluator, parent, deps):
+                    return body(evaluator, parent, deps)
+                return orelse(evaluator, parent, deps)
+            return code, has_refs
+        # handle compares
+        elif isinstance(node, ast.Compare):
+            left, has_refs = cls._acp_compile(node.left)
+            comparators, comparators_have_refs = cls._acp_compile_all(
+                node.comparators)
+            comparisons = list(zip([_COMPARE_OPERATORS[ast_op.__class__]
+                                    for ast_op in node.ops], comparators))
+            def code(evaluator, parent, deps):
+                lhs = left(evaluator, parent, deps)
+                for op, comparator in comparisons:
+                    rhs = comparator(evaluator, parent, deps)
+                    if not op(lhs, rhs):
+                        return False
+                    lhs = rhs
+                return True
+            return code, has_refs | comparators_have_refs
+        # handle boolean operators
+        elif isinstance(node, ast.BoolOp):
+            values, has_refs = cls._acp_compile_all(node.values)
+            if node.op.__class__ == ast.And:
+                def code(evaluator, parent, deps):
+                    for value in values:
+                        if not value(evaluator, parent, deps):
+                            return False
+                    return True
+            else:
+                def code(evaluator, parent, deps):
+                    for value in values:
+                        if value(evaluator, parent, deps):
+                            return True
+                    return False
+            return code, has_refs
+        raise SyntaxError("unsupported expression: " + ast.dump(node))
+
+    @classmethod
+    def _acp_compile_all(cls, nodes):
+        """
+        compile a sequence of ast-nodes.
+        returns a list of the compiled functions and a bool indicating
+        if any of them has external references.
+        """
+        codes = []
+        has_refs = False
+        for node in nodes:
+            code, node_has_refs = cls._acp_compile(node)
+            codes.append(code)
+            has_refs |= node_has_refs
+        return codes, has_refs
+
+    @staticmethod
+    def _acp_references(node):
+        """
+        yields the dotted names of all references in the ast-nodes.
+        """
+        pending = [node]
+        while pending:
+            node = pending.pop()
+            if isinstance(node, (ast.Name, ast.Attribute)):
+                base = node
+                while isinstance(base, ast.Attribute):
+                    base = base.value
+                if isinstance(base, ast.Name):
+                    yield LazyEval._acp_reference_name(node)
+                    continue
+            elif isinstance(node, ast.Call):
+                # the called function is not a reference
+                pending.extend(node.args)
+                pending.extend(keyword.value for keyword in node.keywords)
+                continue
+            pending.extend(ast.iter_child_nodes(node))
+
+    @staticmethod
+    def _acp_reference_name(node):
+        """
+        returns the dotted name of a reference given as
+        ast.Name or (nested) ast.Attribute node.
+        """
+        ref = ""
+        while isinstance(node, ast.Attribute):
+            ref = "." + node.attr + ref
+            node = node.value
+        if not isinstance(node, ast.Name):
+            raise SyntaxError("unsupported reference: " + ast.dump(node))
+        return node.id + ref
+
+    @classmethod
+    def _acp_resolve_reference(cls, ref, parent, deps=None):
+        """
+        resolves external references through the reference index of the
+        parent section. like a walk up the tree the closest scope with a
+        complete match wins.
+        the index entry and the options read on the way are added to deps.
         """
-        attrs = ref.split(".")
         while parent is not None:
+            reference = parent._acp_resolve(ref)
+            if reference is None:
+                break
             try:
-                obj = parent
-                for attr in attrs:
-                    obj = getattr(obj, attr)
+                read = [reference]
+                obj = reference.target
+                if isinstance(obj, Option):
+                    read.append(obj)
+                    obj = obj._acp_value
+                obj = cls._acp_follow(obj, reference.attrs, read)
+                if deps is not None:
+                    deps.update(read)
                 return obj
             except (KeyError, AttributeError):
-                parent = parent._acp_parent
+                # the value of an inner scope failing the lookup decides
+                # as well, so a change to it has to invalidate the result
+                if deps is not None:
+                    deps.update(read)
+                parent = reference.scope._acp_parent
         raise AttributeError(ref)
 
+    @staticmethod
+    def _acp_follow(obj, attrs, read):
+        """
+        look up the remaining attributes of a reference on a value.
+        options met on the way are evaluated and appended to read.
+        """
+        for attr in attrs:
+            if isinstance(obj, Section):
+                obj = obj.__getattribute__(attr, True)
+            else:
+                obj = getattr(obj, attr)
+            if isinstance(obj, Option):
+                read.append(obj)
+                obj = obj._acp_value
+        return obj
+
+
+class AsyncConfigFile(object):
+    """
+    keeps the tree parsed from a file up to date without blocking the
+    event loop. "await load()" parses the file with parse_file_async() and
+    then replaces root by the new tree in a single assignment, so readers
+    of root see either the old or the new tree but never a mix of both.
+    if parsing fails the old tree is kept. of overlapping loads the one
+    started last wins.
+    """
+    def __init__(self, filename, compiled=False, compact=False,
+                 executor=None):
+        self.filename = filename
+        self.compiled = compiled
+        self.compact = compact
+        self.executor = executor
+        self.root = None
+        # counts the loads started so far
+        self._acp_generation = 0
+
+    async def load(self):
+        """
+        parse the file again and return the current tree.
+        """
+        self._acp_generation += 1
+        generation = self._acp_generation
+        root = await parse_file_async(self.filename, self.compiled,
+                                      self.compact, self.executor)
+        if generation == self._acp_generation:
+            self.root = root
+        return self.root
+    reload = load
+
+
+class Instrumentation(object):
+    """
+    collects statistics about the evaluation of options while active:
+    cache hits and misses and evaluation counts and times per option, the
+    number of evaluated ast-nodes and count, time and depth of reference
+    resolutions. the depth is the number of index entries and options a
+    resolution went through.
+    callback is optionally called as callback(kind, name, seconds) for
+    every event where kind is "hit", "evaluate" or "resolve" and name the
+    dotted path of the option or the resolved reference.
+    start() swaps the LazyEval descriptor of Option for an instrumented one
+    and stop() swaps it back so that nothing is measured otherwise.
+    """
+    _acp_active = None
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self._acp_lock = threading.Lock()
+        self.reset()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset(self):
+        with self._acp_lock:
+            self._acp_nodes = 0
+            # per option [evaluations, seconds, hits]
+            self._acp_options = {}
+            # per (section, reference) [resolutions, seconds, max depth]
+            self._acp_references = {}
+
+    def start(self):
+        with _GRAPH_LOCK:
+            if Instrumentation._acp_active is not None:
+                raise RuntimeError("another instrumentation is active")
+            Instrumentation._acp_active = self
+            Option._acp_value = _InstrumentedLazyEval(self)
+
+    def stop(self):
+        with _GRAPH_LOCK:
+            if Instrumentation._acp_active is self:
+                Instrumentation._acp_active = None
+                Option._acp_value = LazyEval()
+
+    def stats(self, top=10):
+        """
+        returns a dict with the total "hits", "misses", "hit_ratio" and
+        "nodes", the "evaluations", "seconds" and "hits" per dotted option
+        path in "options" and the top hottest reference resolutions by
+        time in "references" as dicts with "reference", "section",
+        "resolutions", "seconds" and "depth".
+        """
+        with self._acp_lock:
+            options = dict((_acp_path(option), {"evaluations": evaluations,
+                                                "seconds": seconds,
+                                                "hits": hits})
+                           for option, (evaluations, seconds, hits)
+                           in self._acp_options.items())
+            references = sorted(
+                ({"reference": ref, "section": _acp_path(section),
+                  "resolutions": resolutions, "seconds": seconds,
+                  "depth": depth}
+                 for (section, ref), (resolutions, seconds, depth)
+                 in self._acp_references.items()),
+                key=lambda entry: entry["seconds"], reverse=True)[:top]
+            nodes = self._acp_nodes
+        hits = sum(entry["hits"] for entry in options.values())
+        misses = sum(entry["evaluations"] for entry in options.values())
+        return {"hits": hits, "misses": misses,
+                "hit_ratio": hits / float(hits + misses) if hits + misses
+                             else 0.0,
+                "nodes": nodes, "options": options, "references": references}
+
+    def _acp_record_option(self, option, evaluations, seconds, hits):
+        with self._acp_lock:
+            entry = self._acp_options.get(option)
+            if entry is None:
+                entry = self._acp_options[option] = [0, 0.0, 0]
+            entry[0] += evaluations
+            entry[1] += seconds
+            entry[2] += hits
+        if self.callback is not None:
+            self.callback("hit" if hits else "evaluate", _acp_path(option),
+                          seconds)
+
+    def _acp_record_reference(self, ref, parent, seconds, depth):
+        with self._acp_lock:
+            entry = self._acp_references.get((parent, ref))
+            if entry is None:
+                entry = self._acp_references[(parent, ref)] = [0, 0.0, 0]
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], depth)
+        if self.callback is not None:
+            self.callback("resolve", ref, seconds)
+
+
+class _InstrumentedLazyEval(LazyEval):
+    """
+    LazyEval reporting to an Instrumentation.
+    """
+    def __init__(self, instrumentation):
+        self._acp_instrumentation = instrumentation
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        val = instance._acp_cache
+        if val is not _NOT_CACHED and val.__class__ is not _Evaluation:
+            self._acp_instrumentation._acp_record_option(instance, 0, 0.0, 1)
+            return val
+        start = time.perf_counter()
+        try:
+            return self._acp_evaluate(instance)
+        finally:
+            self._acp_instrumentation._acp_record_option(
+                instance, 1, time.perf_counter() - start, 0)
+
+    def _acp_eval(self, parent, node, deps):
+        self._acp_instrumentation._acp_nodes += 1
+        return super(_InstrumentedLazyEval, self)._acp_eval(parent, node,
+                                                            deps)
+
+    def _acp_resolve_reference(self, ref, parent, deps=None):
+        read = set()
+        start = time.perf_counter()
+        try:
+            return LazyEval._acp_resolve_reference(ref, parent, read)
+        finally:
+            self._acp_instrumentation._acp_record_reference(
+                ref, parent, time.perf_counter() - start, len(read))
+            if deps is not None:
+                deps.update(read)
+
+
+class _FoldingLazyEval(LazyEval):
+    """
+    LazyEval for Section.fold_constants() refusing operations that could
+    take long or make large values before computing them, like the ast
+    optimizer of CPython.
+    """
+    def _acp_eval(self, parent, node, deps):
+        if isinstance(node, ast.BinOp):
+            lhs, lhs_has_refs = self._acp_eval(parent, node.left, deps)
+            rhs, rhs_has_refs = self._acp_eval(parent, node.right, deps)
+            if (node.op.__class__ not in _BINARY_OPERATORS or
+                    not self._acp_is_safe(node.op, lhs, rhs)):
+                raise RuntimeError("not folded")
+            return (_BINARY_OPERATORS[node.op.__class__](lhs, rhs),
+                    lhs_has_refs | rhs_has_refs)
+        elif (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+                and node.func.id in ("pow", "range")):
+            raise RuntimeError("not folded")
+        return super(_FoldingLazyEval, self)._acp_eval(parent, node, deps)
+
+    @staticmethod
+    def _acp_is_safe(op, lhs, rhs):
+        sequences = (str, bytes, tuple, list)
+        if isinstance(op, ast.Mult):
+            if isinstance(lhs, int) and isinstance(rhs, int):
+                return (lhs == 0 or rhs == 0 or lhs.bit_length() +
+                        rhs.bit_length() <= _FOLD_MAX_INT_BITS)
+            if isinstance(lhs, int) and isinstance(rhs, sequences):
+                lhs, rhs = rhs, lhs
+            if isinstance(lhs, sequences) and isinstance(rhs, int):
+                limit = (_FOLD_MAX_STR_SIZE if isinstance(lhs, (str, bytes))
+                         else _FOLD_MAX_COLLECTION_SIZE)
+                return rhs <= 0 or len(lhs) * rhs <= limit
+        elif isinstance(op, ast.Pow):
+            if isinstance(lhs, int) and isinstance(rhs, int) and rhs > 0:
+                return (lhs.bit_length() * rhs <= _FOLD_MAX_INT_BITS or
+                        abs(lhs) <= 1)
+        elif isinstance(op, ast.LShift):
+            if isinstance(lhs, int) and isinstance(rhs, int) and rhs > 0:
+                return (lhs == 0 or
+                        lhs.bit_length() + rhs <= _FOLD_MAX_INT_BITS)
+        elif isinstance(op, ast.Mod):
+            # formatting may pad to any width
+            return not isinstance(lhs, (str, bytes))
+        return True
+
+
+class _Evaluation(object):
+    """
+    marks an option whose value is being evaluated by thread.
+    version is LazyEval._acp_version when the evaluation started. the
+    result is only cached if nothing it was computed from has been
+    changed since, see _acp_changed.
+    threads waiting for the result create event and wait for it.
+    """
+    __slots__ = ("thread", "version", "event")
+
+    def __init__(self, thread, version):
+        self.thread = thread
+        self.version = version
+        self.event = None
+
+    def finish(self):
+        if self.event is not None:
+            self.event.set()
+
+
+class _Reference(object):
+    """
+    entry of a section's reference index.
+    target is the section or option the reference points to in scope,
+    attrs are the remaining attributes to look up on the target's value.
+    options evaluated through this entry register in _acp_dependents.
+    """
+    __slots__ = ("scope", "target", "attrs", "_acp_dependents",
+                 "_acp_changed")
+
+    def __init__(self, scope, target, attrs):
+        self.scope = scope
+        self.target = target
+        self.attrs = attrs
+        self._acp_dependents = None
+        # LazyEval._acp_version of the last invalidation
+        self._acp_changed = 0
+
 
 class Option(object):
+    """
+    Option objects hold the ast-nodes of a value and evaluate them lazily.
+    an option without ast-nodes holds a static value instead.
+    """
+    __slots__ = ("_acp_name", "_acp_parent", "_acp_has_refs",
+                 "_acp_nesting_level", "_acp_ast", "_acp_dependents",
+                 "_acp_code", "_acp_cache", "_acp_source", "_acp_changed",
+                 "_acp_origin", "__weakref__")
+
     def __init__(self):
         self._acp_name = ""
         self._acp_parent = None
         self._acp_has_refs = True
         self._acp_nesting_level = 0
-        self._acp_ast_node = None
+        # the ast-nodes, None or their packed form after unpickling
+        self._acp_ast = None
+        # options depending on this one. created on first use.
+        self._acp_dependents = None
+        self._acp_code = None
+        # the evaluated value or the static value if there are no ast-nodes
+        self._acp_cache = _NOT_CACHED
+        # the source text of the value as parsed or None once it changed
+        self._acp_source = None
+        # LazyEval._acp_version of the last invalidation
+        self._acp_changed = 0
+        # the option of a layer this overlay option follows, see Overlay
+        self._acp_origin = None
+
+    def _acp_is_cached(self):
+        return (self._acp_cache is not _NOT_CACHED and
+                self._acp_cache.__class__ is not _Evaluation)
+
+    def _acp_get_ast_node(self):
+        node = self._acp_ast
+        if type(node) is tuple:
+            node = self._acp_ast = _acp_unpack_ast(node)
+        return node
+    def _acp_set_ast_node(self, node):
+        self._acp_ast = node
+    _acp_ast_node = property(_acp_get_ast_node, _acp_set_ast_node)
+
+    def __getstate__(self):
+        # compiled closures can not be pickled and are rebuilt instead.
+        # cached values are only kept if they do not depend on other
+        # options since the dependents are not pickled.
+        # the ast-nodes are packed into tuples which are much cheaper to
+        # unpickle and only unpacked again when they are needed.
+        state = dict((name, getattr(self, name)) for name in self.__slots__
+                     if name != "__weakref__")
+        state["_acp_code"] = self._acp_code is not None
+        state["_acp_origin"] = None
+        state["_acp_dependents"] = None
+        # versions are only meaningful within this process
+        state["_acp_changed"] = 0
+        if isinstance(self._acp_ast, ast.AST):
+            state["_acp_ast"] = _acp_pack_ast(self._acp_ast)
+        if (self._acp_cache is _NOT_CACHED or
+                self._acp_cache.__class__ is _Evaluation or
+                (self._acp_ast is not None and self._acp_has_refs)):
+            del state["_acp_cache"]
+        return state
+
+    def __setstate__(self, state):
+        compiled = state.pop("_acp_code")
+        self._acp_code = None
+        self._acp_cache = state.pop("_acp_cache", _NOT_CACHED)
+        for name, value in state.items():
+            setattr(self, name, value)
+        if compiled and self._acp_ast is not None:
+            self._acp_compile()
+
+    def _acp_define(self, node, source, compiled=False, compact=False):
+        """
+        set the value to the parsed ast-nodes and keep their source text.
+        """
+        if (self._acp_cache is _NOT_CACHED and self._acp_ast is None and
+                not compiled):
+            # a new option. there is nothing to invalidate.
+            if compact and _acp_is_literal(node):
+                self._acp_cache = ast.literal_eval(node)
+            else:
+                self._acp_ast = node
+            if not compact:
+                self._acp_source = source
+            return
+        if compact and _acp_is_literal(node):
+            self._acp_value = ast.literal_eval(node)
+        else:
+            self._acp_value = node
+            if compiled and self._acp_code is None:
+                self._acp_compile()
+        if not compact:
+            self._acp_source = source
+
+    def _acp_proxy(self):
+        """
+        returns a new option sharing the ast-nodes, the compiled code and
+        the source text of this one but caching its own value.
+        the new option follows this one until it is set itself.
+        """
+        proxy = Option()
+        proxy._acp_name = self._acp_name
+        proxy._acp_origin = self
+        with _GRAPH_LOCK:
+            proxy._acp_follow()
+        return proxy
+
+    def _acp_follow(self):
+        # copy the definition of the origin and get invalidated with it.
+        # the origin only holds a weak reference so that dropped overlays
+        # are not kept alive by their layers.
+        origin = self._acp_origin
+        self._acp_ast = origin._acp_ast_node
+        self._acp_code = origin._acp_code
+        self._acp_source = origin._acp_source
+        self._acp_has_refs = origin._acp_has_refs
+        if self._acp_ast is None:
+            self._acp_cache = origin._acp_cache
+        elif self._acp_cache.__class__ is not _Evaluation:
+            self._acp_cache = _NOT_CACHED
+        if origin._acp_dependents is None:
+            origin._acp_dependents = set()
+        origin._acp_dependents.add(weakref.ref(self,
+                                               _acp_forget(origin)))
+
+    def _acp_defined_as(self, node):
+        """
+        returns True if the option already holds the value of the ast-nodes.
+        """
+        if self._acp_ast is None:
+            return (_acp_is_literal(node) and
+                    repr(ast.literal_eval(node)) == repr(self._acp_cache))
+        return ast.dump(node) == ast.dump(self._acp_ast_node)
+
+    def _acp_compile(self):
+        """
+        evaluate this option through closures compiled from its ast-nodes.
+        """
+        self._acp_code, self._acp_has_refs = LazyEval._acp_compile(
+            self._acp_ast_node)
+
+    def _acp_dependencies(self):
+        """
+        returns the options referred to in this option's ast-nodes.
+        references that can not be resolved are skipped. they raise an
+        error when the option is evaluated.
+        """
+        dependencies = []
+        if self._acp_ast_node is None:
+            return dependencies
+        for ref in LazyEval._acp_references(self._acp_ast_node):
+            reference = self._acp_parent._acp_resolve(ref)
+            if reference is not None and isinstance(reference.target, Option):
+                dependencies.append(reference.target)
+        return dependencies
 
     def _acp_get_raw_value(self):
-        return ast_to_src(self._acp_ast_node)
+        # the source text is kept from parsing until the value is changed.
+        # regenerated text of ast-nodes is kept as well.
+        if self._acp_source is not None:
+            return self._acp_source
+        if self._acp_ast_node is None:
+            return repr(self._acp_value)
+        from ast_to_src import ast_to_src
+        self._acp_source = ast_to_src(self._acp_ast_node)
+        return self._acp_source
 
     _acp_value = LazyEval()
     _acp_raw_value = property(_acp_get_raw_value)
@@ -443,3 +2548,80 @@ class Option(object):
         return '<Option {self._acp_name}>'.format(**locals())
     __repr__ = __str__
 
+
+class Snapshot(object):
+    """
+    read-only view of a section exported by Section.export_snapshot().
+    sub-sections and options are looked up by binary search in the buffer
+    and option values are unpickled on their first access. mutable values
+    are unpickled again on every access so that changing one does not
+    change the snapshot.
+    """
+    __slots__ = ("_acp_buffer", "_acp_count", "_acp_prefix", "_acp_values")
+
+    def __init__(self, buffer, count, prefix="", values=None):
+        object.__setattr__(self, "_acp_buffer", buffer)
+        object.__setattr__(self, "_acp_count", count)
+        object.__setattr__(self, "_acp_prefix", prefix)
+        # immutable values and views already looked up by dotted key
+        object.__setattr__(self, "_acp_values",
+                           {} if values is None else values)
+
+    def __str__(self):
+        return '<Snapshot "{name}">'.format(name=self._acp_prefix[:-1])
+    __repr__ = __str__
+
+    def __getattr__(self, attr):
+        if "." in attr:
+            raise AttributeError(attr)
+        key = self._acp_prefix + attr
+        try:
+            return self._acp_values[key]
+        except KeyError:
+            pass
+        entry = self._acp_find(key.encode("utf-8"))
+        if entry is None:
+            raise AttributeError(attr)
+        offset, length, value_offset, value_length, is_section = entry
+        if is_section:
+            value = Snapshot(self._acp_buffer, self._acp_count, key + ".",
+                             self._acp_values)
+        else:
+            import pickle
+            value = pickle.loads(
+                self._acp_buffer[value_offset:value_offset + value_length])
+            if not _acp_is_constant(value):
+                return value
+        self._acp_values[key] = value
+        return value
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError as e:
+            raise KeyError(str(e))
+
+    def __setattr__(self, attr, val):
+        raise AttributeError("snapshots are read-only")
+
+    def __delattr__(self, attr):
+        raise AttributeError("snapshots are read-only")
+
+    def _acp_find(self, key):
+        """
+        returns the entry of the utf-8 encoded dotted key or None.
+        """
+        buffer = self._acp_buffer
+        low, high = 0, self._acp_count
+        while low < high:
+            middle = (low + high) // 2
+            entry = _SNAPSHOT_ENTRY.unpack_from(
+                buffer, _SNAPSHOT_HEADER.size + middle * _SNAPSHOT_ENTRY.size)
+            found = buffer[entry[0]:entry[0] + entry[1]].tobytes()
+            if found < key:
+                low = middle + 1
+            elif found > key:
+                high = middle
+            else:
+                return entry
+        return None
@@ -0,0 +1,491 @@
+"""
+benchmarks for AdvancedConfigParser.
+
+run with:
+$ python bench_AdvancedConfigParser.py [--quick] [--json FILE] [--compare FILE]
+
+--json writes the results to FILE so that later runs can --compare
+against them.
+"""
+
+from __future__ import print_function
+
+import io
+import os
+import sys
+import json
+import shutil
+import subprocess
+import asyncio
+import argparse
+import platform
+import tempfile
+import timeit
+import tracemalloc
+
+from AdvancedConfigParser import parse_file, parse_files, parse_string
+from AdvancedConfigParser import parse_file_async
+from AdvancedConfigParser import Option, LazyEval, Overlay
+from ast_to_src import ast_to_src
+
+def generate_config(sections=10, options=50, depth=1, multi_line=0, chain=0):
+    """
+    build a config of the given number of top-level sections each nested
+    depth levels deep. every section holds options alternating between
+    literals and expressions referring to the previous option, to the
+    parent section and to the global scope.
+    if multi_line is positive every section also gets a list spanning that
+    many lines. if chain is positive a chain of that many options each
+    referring to the previous one is added to the global scope and the
+    last option of every section refers to its end.
+    """
+    lines = ["g = 1"]
+    for i in range(chain):
+        lines.append("c{i} = {previous} + 1".format(
+            i=i, previous="c{0}".format(i - 1) if i else "g"))
+    for s in range(sections):
+        for level in range(1, depth + 1):
+            lines.append("{left}s{s}_{level}{right}".format(
+                left="[" * level, right="]" * level, s=s, level=level))
+            for i in range(options):
+                if i % 2 == 0:
+                    lines.append("o{i} = [{i}, 'v{i}']".format(i=i))
+                else:
+                    lines.append("o{i} = len(o{previous}) * {i} + g".format(
+                        i=i, previous=i - 1))
+            if multi_line:
+                lines.append("table = [")
+                lines.extend("    ({i}, 'row {i}'),".format(i=i)
+                             for i in range(multi_line))
+                lines.append("]")
+            if chain:
+                lines.append("chained = c{last} * 2".format(last=chain - 1))
+    return "\n".join(lines) + "\n"
+
+def timed(stmt, number=1, repeat=3, setup=None):
+    """
+    returns the best time of a single run of stmt in seconds.
+    setup is called before every repetition outside of the timing.
+    """
+    best = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        t = timeit.timeit(stmt, number=number) / number
+        best = t if best is None else min(best, t)
+    return best
+
+def _acp_all_options(config):
+    return [option for section in config._acp_walk_sections()
+            for option in section._acp_options()]
+
+def bench_hot_paths(sections=10, options=50, depth=1, multi_line=0, chain=0):
+    """
+    time the hot paths on a generated config:
+    parse: parse_stream() of the source.
+    eval_first: evaluating every option once after clearing the caches.
+    eval_repeated: reading every option again from the cache.
+    resolve_reference: resolving every reference of every option through
+                       the warm reference index.
+    pretty_print: dumping the config.
+    ast_to_src: regenerating the source of every option.
+    """
+    source = generate_config(sections, options, depth, multi_line, chain)
+    results = {}
+    results["parse"] = timed(lambda: parse_string(source))
+    config = parse_string(source)
+    all_options = _acp_all_options(config)
+    def evaluate():
+        for option in all_options:
+            option._acp_value
+    results["eval_first"] = timed(evaluate, setup=config.clear_cache)
+    evaluate()
+    results["eval_repeated"] = timed(evaluate, number=10)
+    references = [(ref, option._acp_parent) for option in all_options
+                  if option._acp_ast_node is not None
+                  for ref in LazyEval._acp_references(option._acp_ast_node)]
+    def resolve():
+        for ref, parent in references:
+            LazyEval._acp_resolve_reference(ref, parent)
+    results["resolve_reference"] = timed(resolve, number=10)
+    results["pretty_print"] = timed(config.pretty_print)
+    nodes = [option._acp_ast_node for option in all_options]
+    def regenerate():
+        for node in nodes:
+            ast_to_src(node)
+    results["ast_to_src"] = timed(regenerate)
+    return results
+
+# parameters of the generated configs run by the suite. every parameter is
+# varied on its own against the first entry.
+SUITE = [dict(sections=10, options=50, depth=1, multi_line=0, chain=0),
+         dict(sections=10, options=500, depth=1, multi_line=0, chain=0),
+         dict(sections=100, options=50, depth=1, multi_line=0, chain=0),
+         dict(sections=10, options=50, depth=5, multi_line=0, chain=0),
+         dict(sections=10, options=50, depth=1, multi_line=200, chain=0),
+         dict(sections=10, options=50, depth=1, multi_line=0, chain=100)]
+
+def nested_expression(depth):
+    """
+    build an expression nesting arithmetic, calls, compares and
+    ternaries depth levels deep around references to "a" and "b".
+    """
+    expr = "a"
+    templates = ("({expr} + b * {i})",
+                 "max({expr}, {i}, a)",
+                 "({expr} if a < {i} <= b + {i} else b)",
+                 "abs({expr} - a // 2)")
+    for i in range(depth):
+        expr = templates[i % len(templates)].format(expr=expr, i=i)
+    return expr
+
+def bench_eval(depth=40, number=2000):
+    """
+    time a single evaluation of a deeply nested option with the
+    interpreter and with the compiled closures.
+    the cache is bypassed so that every run really evaluates.
+    """
+    source = "a = 3\nb = 7\nx = {expr}\n".format(expr=nested_expression(depth))
+    evaluator = Option._acp_value
+    results = {}
+    for compiled in (False, True):
+        config = parse_string(source, compiled=compiled)
+        option = config.__getattribute__("x", True)
+        if compiled:
+            def stmt():
+                option._acp_code(evaluator, config, set())
+        else:
+            def stmt():
+                evaluator._acp_eval(config, option._acp_ast_node, set())
+        results[compiled] = min(timeit.repeat(stmt, number=number,
+                                              repeat=3)) / number
+    return results
+
+def bench_multi_line_parse(lines=2000, number=3):
+    """
+    time parsing a single list option spanning the given number of lines.
+    """
+    source = "table = [\n{rows}]\n".format(
+        rows="".join("    ({i}, 'row {i}', [{i}, {i}]),\n".format(i=i)
+                     for i in range(lines)))
+    return min(timeit.repeat(lambda: parse_string(source), number=number,
+                             repeat=3)) / number
+
+def bench_flat_parse(options=10000, number=1):
+    """
+    time parsing a single section with the given number of options.
+    """
+    source = "".join("option_{i} = {i}\n".format(i=i) for i in range(options))
+    return min(timeit.repeat(lambda: parse_string(source), number=number,
+                             repeat=3)) / number
+
+def bench_memory(options=20000):
+    """
+    measure the memory held by a parsed config of mostly literal options
+    with the default layout and in compact mode.
+    """
+    source = "".join("o{i} = {i}\ns{i} = 'value {i}'\nl{i} = [{i}, {i}.5]\n"
+                     "e{i} = o{i} * 2\n".format(i=i)
+                     for i in range(options // 4))
+    results = {}
+    for compact in (False, True):
+        tracemalloc.start()
+        config = parse_string(source, compact=compact)
+        results[compact] = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del config
+    return results
+
+def bench_dump(options=10000, number=1):
+    """
+    time dumping sections of options to a string and streaming them to a
+    file-like object.
+    """
+    source = "".join("[s{i}]\no{i} = {i}\ne{i} = o{i} * 2\n".format(i=i)
+                     for i in range(options // 2))
+    config = parse_string(source)
+    results = {}
+    results["dump"] = min(timeit.repeat(config.dump, number=number,
+                                        repeat=3)) / number
+    results["dump_to"] = min(timeit.repeat(
+        lambda: config.dump_to(io.StringIO()), number=number,
+        repeat=3)) / number
+    return results
+
+def bench_fold(number=2000):
+    """
+    time a single evaluation of an option mixing references with static
+    sub-expressions before and after folding the constants.
+    """
+    source = ("a = 3\nx = a * (2 ** 10 * 3) + max([1, 2, 3]) - "
+              "abs(-7) * (a + len('abc' * 4)) + (1 if 2 < 3 else 0)\n")
+    evaluator = Option._acp_value
+    results = {}
+    for fold in (False, True):
+        config = parse_string(source)
+        if fold:
+            config.fold_constants()
+        option = config.__getattribute__("x", True)
+        def stmt():
+            evaluator._acp_eval(config, option._acp_ast_node, set())
+        results[fold] = min(timeit.repeat(stmt, number=number,
+                                          repeat=3)) / number
+    return results
+
+def bench_throughput(megabytes=4):
+    """
+    measure the parsing speed of parse_file() in MB/s on a generated file
+    of about the given size with comments, empty lines and multi-line
+    options.
+    """
+    part = generate_config(sections=20, options=50, depth=2, multi_line=20)
+    part += "".join("\n# comment {i}\n    \n".format(i=i) for i in range(500))
+    repeat = max(int(megabytes * 1e6 / len(part)), 1)
+    directory = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(directory, "bench.cfg")
+        with open(filename, "w") as f:
+            for i in range(repeat):
+                # section names must be unique
+                f.write(part.replace("[s", "[r{i}_s".format(i=i)))
+        size = os.path.getsize(filename)
+        seconds = timed(lambda: parse_file(filename))
+    finally:
+        shutil.rmtree(directory)
+    return size / 1e6 / seconds
+
+def bench_lazy_parse(sections=1000, options=20, number=1):
+    """
+    time parsing a file of many top-level sections eagerly, lazily and
+    lazily followed by reading one option.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(directory, "bench.cfg")
+        with open(filename, "w") as f:
+            for i in range(sections):
+                f.write("[s{i}]\n".format(i=i))
+                f.write("".join("o{j} = [{j}, {i}]\n".format(i=i, j=j)
+                                for j in range(options)))
+        results = {}
+        results["eager"] = min(timeit.repeat(
+            lambda: parse_file(filename), number=number, repeat=3)) / number
+        results["lazy"] = min(timeit.repeat(
+            lambda: parse_file(filename, lazy=True), number=number,
+            repeat=3)) / number
+        results["lazy_read"] = min(timeit.repeat(
+            lambda: parse_file(filename, lazy=True).s0.o0, number=number,
+            repeat=3)) / number
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+def bench_parse_files(files=8, sections=100, workers=None):
+    """
+    time parsing several generated files one after the other with
+    parse_file() and merged with parse_files() in a process pool.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        filenames = []
+        for i in range(files):
+            filenames.append(os.path.join(directory, "{0}.cfg".format(i)))
+            with open(filenames[-1], "w") as f:
+                f.write(generate_config(sections, depth=2))
+        results = {}
+        results["serial"] = timed(lambda: [parse_file(filename)
+                                           for filename in filenames])
+        results["parallel"] = timed(lambda: parse_files(filenames,
+                                                        workers=workers))
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+def bench_overlay(overlays=1000, sections=10, options=50):
+    """
+    measure the memory held by many overlays of one generated base that
+    each override a global option and read an option of one section,
+    and the time to set up and read a single overlay.
+    """
+    base = parse_string(generate_config(sections, options))
+    override = parse_string("g = 2\n")
+    def read():
+        overlay = Overlay(base, override)
+        overlay.s0_1.o1
+        return overlay
+    results = {}
+    tracemalloc.start()
+    kept = [read() for _ in range(overlays)]
+    results["memory"] = tracemalloc.get_traced_memory()[0] / overlays
+    tracemalloc.stop()
+    del kept
+    results["read"] = timed(read, number=100)
+    return results
+
+def bench_async(sections=1000):
+    """
+    measure the longest stall of an event loop ticking every millisecond
+    while a generated file is parsed on the loop with parse_file() and
+    with parse_file_async().
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(directory, "bench.cfg")
+        with open(filename, "w") as f:
+            f.write(generate_config(sections))
+        async def stall(parse):
+            loop = asyncio.get_running_loop()
+            longest = [0.0]
+            done = []
+            async def tick():
+                last = loop.time()
+                while not done:
+                    await asyncio.sleep(0.001)
+                    now = loop.time()
+                    longest[0] = max(longest[0], now - last)
+                    last = now
+            ticker = asyncio.ensure_future(tick())
+            await asyncio.sleep(0.01)
+            await parse()
+            done.append(True)
+            await ticker
+            return longest[0]
+        async def blocking():
+            parse_file(filename)
+        async def offloaded():
+            await parse_file_async(filename)
+        results = {}
+        results["blocking"] = asyncio.run(stall(blocking))
+        results["async"] = asyncio.run(stall(offloaded))
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+_IMPORT_SCRIPT = """
+import time
+start = time.perf_counter()
+import AdvancedConfigParser
+imported = time.perf_counter()
+AdvancedConfigParser.parse_string("a = 1\\n[s]\\nb = a + 1\\n").s.b
+parsed = time.perf_counter()
+print(imported - start, parsed - imported)
+"""
+
+def bench_import(repeat=5):
+    """
+    time importing the module and the first parse after it in a fresh
+    interpreter. returns the best times of both.
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [directory] + [path for path in [env.get("PYTHONPATH")] if path])
+    results = {}
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, "-c",
+                                          _IMPORT_SCRIPT], env=env)
+        times = dict(zip(("import", "first_parse"),
+                         map(float, output.split())))
+        for key, value in times.items():
+            results[key] = min(results.get(key, value), value)
+    return results
+
+def run_suite(quick=False):
+    """
+    run all benchmarks and return the results as list of dicts with the
+    name of the benchmark, its parameters, the value and its unit.
+    quick runs the smallest sizes only.
+    """
+    records = []
+    def record(benchmark, params, value, unit="s"):
+        records.append({"benchmark": benchmark, "params": params,
+                        "value": value, "unit": unit})
+    for params in (SUITE[:1] if quick else SUITE):
+        for benchmark, value in sorted(bench_hot_paths(**params).items()):
+            record(benchmark, params, value)
+    scale = 10 if quick else 1
+    for options in (20000 // scale, 100000 // scale):
+        results = bench_memory(options)
+        record("memory", {"options": options}, results[False], "bytes")
+        record("memory_compact", {"options": options}, results[True],
+               "bytes")
+        record("flat_parse", {"options": options}, bench_flat_parse(options))
+        results = bench_dump(options)
+        record("dump", {"options": options}, results["dump"])
+        record("dump_to", {"options": options}, results["dump_to"])
+    for sections in (400 // scale, 4000 // scale):
+        results = bench_lazy_parse(sections)
+        for benchmark in ("eager", "lazy", "lazy_read"):
+            record("file_parse_" + benchmark, {"sections": sections},
+                   results[benchmark])
+    for megabytes in (1.0 / scale, 4.0 / scale):
+        record("parse_throughput", {"megabytes": megabytes},
+               bench_throughput(megabytes), "MB/s")
+    for lines in (1000 // scale, 4000 // scale):
+        record("multi_line_parse", {"lines": lines},
+               bench_multi_line_parse(lines))
+    for files in (1, 8):
+        results = bench_parse_files(files, 100 // scale)
+        record("parse_files_serial", {"files": files}, results["serial"])
+        record("parse_files_parallel", {"files": files, "workers":
+                                        os.cpu_count()}, results["parallel"])
+    results = bench_overlay(1000 // scale)
+    record("overlay_memory", {"overlays": 1000 // scale},
+           results["memory"], "bytes")
+    record("overlay_read", {}, results["read"])
+    results = bench_async(1000 // scale)
+    record("loop_stall_blocking", {"sections": 1000 // scale},
+           results["blocking"])
+    record("loop_stall_async", {"sections": 1000 // scale}, results["async"])
+    results = bench_import()
+    record("import", {}, results["import"])
+    record("first_parse", {}, results["first_parse"])
+    results = bench_fold()
+    record("eval_unfolded", {}, results[False])
+    record("eval_folded", {}, results[True])
+    for depth in (10, 80):
+        results = bench_eval(depth)
+        record("eval_interpreted", {"depth": depth}, results[False])
+        record("eval_compiled", {"depth": depth}, results[True])
+    return records
+
+def _acp_record_key(record):
+    return record["benchmark"], json.dumps(record["params"], sort_keys=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="benchmark "
+                                                 "AdvancedConfigParser")
+    parser.add_argument("--quick", action="store_true",
+                        help="run the smallest sizes only")
+    parser.add_argument("--json", metavar="FILE",
+                        help="write the results to FILE")
+    parser.add_argument("--compare", metavar="FILE",
+                        help="compare the results to those in FILE")
+    args = parser.parse_args(argv)
+    records = run_suite(args.quick)
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = dict((_acp_record_key(record), record["value"])
+                            for record in json.load(f)["results"])
+    for record in records:
+        params = ", ".join("{0}={1}".format(key, value) for key, value in
+                           sorted(record["params"].items()))
+        if record["unit"] == "s":
+            value = "{0:12.3f} ms".format(record["value"] * 1e3)
+        elif record["unit"] == "MB/s":
+            value = "{0:12.3f} MB/s".format(record["value"])
+        else:
+            value = "{0:12.3f} MB".format(record["value"] / 1e6)
+        line = "{0:20s} {1:55s} {2}".format(record["benchmark"], params, value)
+        old = baseline.get(_acp_record_key(record))
+        if old:
+            line += "  {0:6.2f}x".format(record["value"] / old)
+        print(line)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"python": sys.version, "platform": platform.platform(),
+                       "results": records}, f, indent=1, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,21 @@
+import io
+import os
+import ast
+import sys
+import gc
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
 import unittest
+import weakref
 
-from AdvancedConfigParser import parse_string
+import AdvancedConfigParser
+from AdvancedConfigParser import parse_file, parse_string, Option, LazyEval
+from AdvancedConfigParser import reload_string, attach_snapshot, iter_events
+from ast_to_src import ast_to_src
 
 class TestAdvancedConfigParser(unittest.TestCase):
     def test_bool(self):
@@ -244,5 +259,894 @@ snafu = 3.141 not in foo
         self.assertEqual(config.Section_2.baz, config2.Section_2.baz)
         self.assertEqual(config.Section_2.snafu, config2.Section_2.snafu)
 
+    def test_cache_invalidation(self):
+        config = parse_string("""
+        a = 1
+        b = a * 2
+        c = 5
+        [Foo]
+        d = b + c
+        e = c
+        """)
+        d = config.Foo.__getattribute__("d", True)
+        e = config.Foo.__getattribute__("e", True)
+        self.assertEqual(config.Foo.d, 7)
+        self.assertEqual(config.Foo.e, 5)
+        self.assertTrue(d._acp_is_cached())
+        config.a = 10
+        self.assertFalse(d._acp_is_cached())
+        self.assertTrue(e._acp_is_cached())
+        self.assertEqual(config.b, 20)
+        self.assertEqual(config.Foo.d, 25)
+        config.c = 1
+        self.assertFalse(d._acp_is_cached())
+        self.assertFalse(e._acp_is_cached())
+        self.assertEqual(config.Foo.d, 21)
+        self.assertEqual(config.Foo.e, 1)
+        # a static value is replaced by ast-nodes
+        config.a = 10
+        config.a = ast.parse("20").body[0].value
+        self.assertEqual(config.a, 20)
+        self.assertEqual(config.b, 40)
+        self.assertEqual(config.__getattribute__("a", True)._acp_raw_value,
+                         "20")
+        # an inner scope failing the lookup is a dependency as well
+        config = parse_string("[S]\nreal = 100\n[Foo]\nS = 'str'\n"
+                              "x = S.real\n")
+        self.assertEqual(config.Foo.x, 100)
+        config.Foo.S = 5
+        self.assertEqual(config.Foo.x, 5)
+
+    def test_compiled(self):
+        source = """
+        a = 3
+        b = [a, (a, 2), {a, 4}, {"x": a, a: [1]}]
+        [Foo]
+        c = a * 2 + len(b) if a > 2 and True or b else -1
+        d = max(1, a, c) < 20 <= sum([c, a]) * 2
+        e = dict(x=c, y=a ** 2)
+        """
+        interpreted = parse_string(source)
+        config = parse_string(source, compiled=True)
+        for section, name in ((config, "b"), (config.Foo, "c"),
+                              (config.Foo, "d"), (config.Foo, "e")):
+            other = interpreted if section is config else interpreted.Foo
+            self.assertEqual(section[name], other[name])
+        self.assertEqual(config.b[3], {"x": 3, 3: [1]})
+        config.a = 1
+        self.assertEqual(config.Foo.c, 6)
+        # an option is left as it was if its new value fails to compile
+        c = config.Foo.__getattribute__("c", True)
+        self.assertRaises(SyntaxError, setattr, config.Foo, "c",
+                          ast.parse("[1][0]").body[0].value)
+        self.assertIsInstance(c._acp_ast_node, ast.IfExp)
+        self.assertEqual(config.Foo.c, 6)
+        config.Foo.c = 8
+        self.assertIsNone(c._acp_code)
+        self.assertEqual(config.Foo.d, False)
+        self.assertRaises(SyntaxError, parse_string, "a = open('x')",
+                          compiled=True)
+        self.assertRaises(SyntaxError, parse_string, "a = [1][0]",
+                          compiled=True)
+
+    def test_reference_index(self):
+        config = parse_string("""
+        a = 1
+        [Foo]
+        b = a
+        [[Bar]]
+        c = a + b
+        d = Baz.x
+        [[Baz]]
+        x = 2
+        """)
+        self.assertEqual(config.Foo.Bar.c, 2)
+        self.assertEqual(config.Foo.Bar.d, 2)
+        self.assertIn("a", config.Foo.Bar._acp_ref_index)
+        reference = config.Foo._acp_resolve("a")
+        self.assertIs(reference.scope, config)
+        self.assertIs(reference.target, config.__getattribute__("a", True))
+        self.assertIsNone(config.Foo._acp_resolve("nope"))
+        # a new option in between shadows the global one
+        option = Option()
+        option._acp_name = "a"
+        option._acp_value = ast.parse("5").body[0].value
+        config.Foo._acp_add_child(option)
+        self.assertEqual(config.Foo.b, 5)
+        self.assertEqual(config.Foo.Bar.c, 10)
+        # so does a new section in front of the sibling one
+        baz = parse_string("[Baz]\nx = 3").Baz
+        baz._acp_parent = None
+        config.Foo.Bar._acp_add_child(baz)
+        self.assertEqual(config.Foo.Bar.d, 3)
+
+    def test_multi_line(self):
+        config = parse_string(r"""
+        a = [1,  # a comment with a bracket ]
+             "[not a section]",
+             [2,
+        [3]], 'x\'y', "(",
+        ]
+        b = '''x = 1
+        [not a section]'''
+        c = 1 + \
+            2
+        d = {"a": (1,
+                   2)}
+        e = 4
+        """)
+        self.assertEqual(config.a, [1, "[not a section]", [2, [3]], "x'y", "("])
+        self.assertEqual(config.b, "x = 1\n        [not a section]")
+        self.assertEqual(config.c, 3)
+        self.assertEqual(config.d, {"a": (1, 2)})
+        self.assertEqual(config.e, 4)
+        self.assertRaises(SyntaxError, parse_string, "a = [1,\nb = 2")
+        self.assertRaises(SyntaxError, parse_string, "a = 'x\nb = 2")
+
+    def test_children(self):
+        config = parse_string("""
+        a = 1
+        [Foo]
+        # comment
+        b = 2
+        [Bar]
+        c = 3
+        """)
+        self.assertEqual(list(config._acp_section_names()), ["Foo", "Bar"])
+        self.assertEqual(list(config._acp_option_names()), ["a"])
+        self.assertEqual([child._acp_name for child in config._acp_children()],
+                         ["a", "Foo", "Bar"])
+        self.assertTrue(config._acp_has_section("Foo"))
+        self.assertFalse(config._acp_has_section("a"))
+        self.assertTrue(config._acp_has_option("a"))
+        self.assertFalse(config.Foo._acp_has_option("a"))
+        self.assertRaises(SyntaxError, parse_string, "[Foo]\n[Foo]")
+        self.assertRaises(SyntaxError, parse_string, "a = 1\na = 2")
+        self.assertRaises(SyntaxError, parse_string, "a = 1\n[a]")
+
+    def test_compact(self):
+        source = """
+        a = 1
+        b = -2.5
+        c = ["x", ("y", None), {1: {2, 3}}, b'z']
+        d = 1e999
+        e = a + 1
+        [Foo]
+        f = 'multi\\nline'
+        """
+        config = parse_string(source, compact=True)
+        expected = parse_string(source)
+        for name in "abcde":
+            self.assertEqual(config[name], expected[name])
+        self.assertEqual(config.Foo.f, expected.Foo.f)
+        for name in "abc":
+            self.assertIsNone(config.__getattribute__(name, True)._acp_ast_node)
+        for name in "de":
+            self.assertIsNotNone(
+                config.__getattribute__(name, True)._acp_ast_node)
+        config2 = parse_string(config.dump())
+        for name in "abce":
+            self.assertEqual(config2[name], config[name])
+        self.assertEqual(config2.Foo.f, config.Foo.f)
+        config.a = 5
+        self.assertEqual(config.e, 6)
+        self.assertTrue(config.dump().startswith("\na = 5\n"))
+        option = Option()
+        self.assertRaises(AttributeError, setattr, option, "foo", 1)
+
+    def test_clear_cache(self):
+        config = parse_string("""
+        a = 1
+        [Foo]
+        b = a + 1
+        """)
+        b = config.Foo.__getattribute__("b", True)
+        self.assertEqual(config.Foo.b, 2)
+        config.clear_cache()
+        self.assertFalse(b._acp_is_cached())
+        self.assertEqual(config.Foo._acp_ref_index, {})
+        self.assertEqual(config.Foo.b, 2)
+        config.a = 3
+        self.assertEqual(config.Foo.b, 4)
+        # static values survive
+        config.a = 7
+        config.clear_cache()
+        self.assertEqual(config.a, 7)
+        self.assertEqual(config.Foo.b, 8)
+
+    def test_reload_memory(self):
+        source = "".join("a{i} = {i}\nb{i} = [a{i}] * 50\n".format(i=i)
+                         for i in range(50))
+        def load():
+            config = parse_string(source)
+            for i in range(50):
+                config["b{i}".format(i=i)]
+            return weakref.ref(config)
+        tracemalloc.start()
+        try:
+            refs = [load() for _ in range(5)]
+            gc.collect()
+            baseline = tracemalloc.get_traced_memory()[0]
+            refs.extend(load() for _ in range(50))
+            gc.collect()
+            growth = tracemalloc.get_traced_memory()[0] - baseline
+        finally:
+            tracemalloc.stop()
+        self.assertEqual([ref for ref in refs if ref() is not None], [])
+        self.assertLess(growth, 50000)
+
+    def test_resolve_all(self):
+        source = "".join("a{i} = a{j} + 1\n".format(i=i, j=i + 1)
+                         for i in range(2000))
+        config = parse_string(source + "a2000 = 0\n[Foo]\nb = a0 * 2\n")
+        config.resolve_all()
+        self.assertTrue(all(option._acp_is_cached()
+                            for option in config._acp_options()))
+        self.assertEqual(config.a0, 2000)
+        self.assertEqual(config.Foo.b, 4000)
+
+    def test_freeze(self):
+        config = parse_string("""
+        a = 1
+        [Foo]
+        b = [a, 2]
+        c = 'x'
+        """)
+        config.freeze()
+        self.assertEqual(config.Foo.__dict__["b"], [1, 2])
+        self.assertEqual(config.Foo.b, [1, 2])
+        self.assertEqual(config.Foo["c"], "x")
+        self.assertRaises(AttributeError, setattr, config, "a", 2)
+        self.assertRaises(AttributeError, setattr, config.Foo, "c", 2)
+        self.assertEqual(parse_string(config.dump()).Foo.b, [1, 2])
+
+    def test_reference_cycle(self):
+        config = parse_string("""
+        a = Foo.b + 1
+        [Foo]
+        b = c
+        c = [1, a]
+        d = 1
+        """)
+        with self.assertRaises(RuntimeError) as context:
+            config.resolve_all()
+        message = str(context.exception)
+        self.assertIn("reference cycle", message)
+        for path in ("a", "Foo.b", "Foo.c"):
+            self.assertIn(path, message)
+        self.assertNotIn("Foo.d", message)
+        self.assertRaises(RuntimeError, getattr, config, "a")
+        # the failed evaluation does not leave anything behind
+        config.Foo.c = 3
+        self.assertEqual(config.a, 4)
+        # cycles through branches that are not taken are no cycles
+        config = parse_string("a = b if True else 0\n"
+                              "b = 1 if True else a\n")
+        config.freeze()
+        self.assertEqual((config.a, config.b), (1, 1))
+
+    def test_file_cache(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        filename = os.path.join(directory, "test.cfg")
+        with open(filename, "w") as f:
+            f.write("a = 2 ** 10\n[Foo]\nb = a + 1\n")
+        config = parse_file(filename, cache=True)
+        self.assertEqual(config.Foo.b, 1025)
+        cache_filename = os.path.join(directory, "__acpcache__",
+                                      "test.cfg.pickle")
+        self.assertTrue(os.path.exists(cache_filename))
+        # unchanged files are loaded from the cache without parsing even if
+        # they were touched
+        parse_stream = AdvancedConfigParser.parse_stream
+        def fail(*args):
+            raise AssertionError("parsed although cached")
+        AdvancedConfigParser.parse_stream = fail
+        try:
+            config = parse_file(filename, cache=True)
+            stat = os.stat(filename)
+            os.utime(filename, (stat.st_atime, stat.st_mtime + 10))
+            config = parse_file(filename, cache=True)
+        finally:
+            AdvancedConfigParser.parse_stream = parse_stream
+        self.assertTrue(config.__getattribute__("a", True)._acp_is_cached())
+        self.assertFalse(
+            config.Foo.__getattribute__("b", True)._acp_is_cached())
+        self.assertEqual(config.Foo.b, 1025)
+        config.a = 1
+        self.assertEqual(config.Foo.b, 2)
+        # same size but different content
+        with open(filename, "w") as f:
+            f.write("a = 2 ** 11\n[Foo]\nb = a + 1\n")
+        self.assertEqual(parse_file(filename, cache=True).Foo.b, 2049)
+        self.assertEqual(parse_file(filename, cache=True).Foo.b, 2049)
+        # compiled trees are cached separately and survive pickling
+        config = parse_file(filename, compiled=True, cache=True)
+        config = parse_file(filename, compiled=True, cache=True)
+        self.assertIsNotNone(config.Foo.__getattribute__("b", True)._acp_code)
+        self.assertEqual(config.Foo.b, 2049)
+        # including options assigned a static value
+        config.a = 5
+        config = pickle.loads(pickle.dumps(config))
+        self.assertEqual((config.a, config.Foo.b), (5, 6))
+        # broken cache files are replaced
+        with open(cache_filename, "wb") as f:
+            f.write(b"garbage")
+        self.assertEqual(parse_file(filename, cache=True).Foo.b, 2049)
+
+    def test_reload(self):
+        source = ("a = 1\nb = 2\n[Foo]\nc = a * 10\nd = b * 10\n"
+                  "[[Bar]]\ne = c + d\n[Baz]\nf = 3\n")
+        config = parse_string(source)
+        self.assertEqual(config.Foo.Bar.e, 30)
+        d = config.Foo.__getattribute__("d", True)
+        e = config.Foo.Bar.__getattribute__("e", True)
+        # reformatting is not a change
+        self.assertEqual(reload_string(config, source.replace("a * 10",
+                                                              "a*10")), [])
+        self.assertTrue(e._acp_is_cached())
+        changed = reload_string(config, source.replace("a = 1", "a = 4")
+                                .replace("f = 3", "g = Foo.c"))
+        self.assertEqual(changed, ["Baz.f", "a", "Baz.g"])
+        # options not depending on the change keep their cached values
+        self.assertTrue(d._acp_is_cached())
+        self.assertFalse(e._acp_is_cached())
+        self.assertIs(config.Foo.Bar.__getattribute__("e", True), e)
+        self.assertEqual(config.Foo.Bar.e, 60)
+        self.assertEqual(config.Baz.g, 40)
+        self.assertFalse(hasattr(config.Baz, "f"))
+        self.assertEqual([child._acp_name for child in config._acp_children()],
+                         ["a", "b", "Foo", "Baz"])
+        # removing an option invalidates references to it and lets them
+        # fall back to enclosing scopes
+        reload_string(config, "a = 4\nb = 2\n[Foo]\nc = 7\n[[Bar]]\n"
+                      "e = b\n[Baz]\nb = 5\ng = b + Foo.c\n")
+        self.assertEqual(config.Baz.g, 12)
+        changed = reload_string(config, "a = 4\nb = 2\n[Foo]\nc = 7\n"
+                                "[[Bar]]\ne = b\n[Baz]\ng = b + Foo.c\n")
+        self.assertEqual(changed, ["Baz.b"])
+        self.assertEqual(config.Baz.g, 9)
+        self.assertRaises(SyntaxError, reload_string, config, "a = 1\nb = (")
+        self.assertEqual(config.a, 4)
+        # static values of compact options and of assigned options are
+        # replaced, too
+        for compact in (False, True):
+            config = parse_string("a = 1\nb = a + 1\n", compact=compact)
+            self.assertEqual(config.b, 2)
+            self.assertEqual(reload_string(config, "a = x\nx = 5\nb = a + 1\n",
+                                           compact=compact), ["a", "x"])
+            self.assertEqual((config.a, config.b), (5, 6))
+        config = parse_string("a = 1\nb = a + 1\n")
+        config.a = 3
+        self.assertEqual(config.b, 4)
+        self.assertEqual(reload_string(config, "a = 1\nb = a + 1\n"), ["a"])
+        self.assertEqual((config.a, config.b), (1, 2))
+        # nothing is changed if compiling or a frozen sub-section fails
+        self.assertRaises(SyntaxError, reload_string, config,
+                          "a = 10\nb = [1][0]\n", compiled=True)
+        self.assertEqual((config.a, config.b), (1, 2))
+        config = parse_string("a = 1\n[Foo]\nb = 2\nc = 3\n")
+        config.Foo.freeze()
+        self.assertRaises(AttributeError, reload_string, config,
+                          "a = 5\n[Foo]\nb = 4\nc = 3\n")
+        self.assertRaises(AttributeError, reload_string, config,
+                          "a = 5\n[Foo]\nb = 2\n")
+        self.assertEqual((config.a, config.Foo.b, config.Foo.c), (1, 2, 3))
+
+    def test_dump_to(self):
+        config = parse_string("x = 1\n# c\n[A]\ny = x + 2\n\n[[B]]\n"
+                              "z = [1, 2]\n[E]\nv = 'a'\n")
+        stream = io.StringIO()
+        config.dump_to(stream)
+        self.assertEqual(stream.getvalue(), config.dump())
+        self.assertEqual(config.A.pretty_print(2),
+                         "  [A]\n   y = x + 2\n\n   [[B]]\n    z = [1, 2]\n")
+        # nesting deeper than the recursion limit
+        depth = sys.getrecursionlimit() + 100
+        source = "".join("{0}s{1}{2}\no = {1}\n".format("[" * i, i, "]" * i)
+                         for i in range(1, depth + 1))
+        stream = io.StringIO()
+        parse_string(source).dump_to(stream)
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(len(lines), 2 * depth)
+        self.assertEqual(lines[-1], " " * depth + "o = {0}".format(depth))
+
+    def test_raw_value(self):
+        config = parse_string("a = 1\nb = max(a,  2) * 3  # six\n"
+                              "c = [1,\n     2]\n")
+        self.assertEqual(config.dump(), "a = 1\nb = max(a,  2) * 3  # six\n"
+                                        "c = [1,\n     2]\n")
+        # changed values are regenerated from their ast-nodes once
+        config.b = ast.parse("a*4").body[0].value
+        option = config.__getattribute__("b", True)
+        self.assertIsNone(option._acp_source)
+        self.assertEqual(option._acp_raw_value, "(a * 4)")
+        self.assertEqual(option._acp_source, "(a * 4)")
+        config.a = "it's"
+        self.assertEqual(config.__getattribute__("a", True)._acp_raw_value,
+                         '"it\'s"')
+        self.assertEqual(ast_to_src(ast.parse("'say \"hi\"'").body[0].value),
+                         "'say \"hi\"'")
+        self.assertRaises(RuntimeError, ast_to_src,
+                          ast.parse("'it\\'s \"x\"'").body[0].value)
+
+    def test_snapshot(self):
+        config = parse_string("a = 2\nb = [a, 'x']\n[Foo]\nc = a * 3\n"
+                              "[[Bar]]\nd = {'k': c}\n[Foo_2]\ne = None\n")
+        data = config.export_snapshot()
+        snapshot = attach_snapshot(data)
+        self.assertEqual(snapshot.a, 2)
+        self.assertEqual(snapshot.b, [2, "x"])
+        self.assertEqual(snapshot.Foo.c, 6)
+        self.assertEqual(snapshot["Foo"].Bar["d"], {"k": 6})
+        self.assertIsNone(snapshot.Foo_2.e)
+        self.assertIs(snapshot.Foo.Bar, snapshot.Foo.Bar)
+        # changing a mutable value does not change the snapshot
+        snapshot.b.append(3)
+        snapshot.Foo.Bar.d["k"] = 7
+        self.assertEqual(snapshot.b, [2, "x"])
+        self.assertEqual(snapshot.Foo.Bar.d, {"k": 6})
+        self.assertRaises(AttributeError, getattr, snapshot, "c")
+        self.assertRaises(AttributeError, getattr, snapshot.Foo, "a")
+        self.assertRaises(KeyError, lambda: snapshot["Foo.c"])
+        self.assertRaises(AttributeError, setattr, snapshot, "a", 3)
+        self.assertRaises(RuntimeError, attach_snapshot, b"garbage")
+        # sub-sections export relative to themselves
+        self.assertEqual(attach_snapshot(config.Foo.export_snapshot()).Bar.d,
+                         {"k": 6})
+        # files are mapped into memory
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        filename = os.path.join(directory, "test.snapshot")
+        self.assertEqual(config.export_snapshot(filename), data)
+        snapshot = attach_snapshot(filename)
+        self.assertEqual(snapshot.Foo.Bar.d, {"k": 6})
+        self.assertEqual(snapshot.b, [2, "x"])
+
+    def test_extract(self):
+        config = parse_string("a = 2\nb = 'x'\n[Foo]\nc = a * 3\n"
+                              "[[Bar]]\nd = [c, 1.5]\n[Baz]\ne = 4 + 2j\n")
+        self.assertEqual(config.extract(["a", "Foo.c", "Foo.Bar.d", "Baz.e.imag"]),
+                         {"a": 2, "Foo.c": 6, "Foo.Bar.d": [6, 1.5],
+                          "Baz.e.imag": 2.0})
+        self.assertEqual(config.Foo.extract(["c", "Bar.d"],
+                                            schema={"c": float,
+                                                    "Bar.d": tuple}),
+                         {"c": 6.0, "Bar.d": (6, 1.5)})
+        settings = config.extract(["a", "Foo.c"], typename="Settings")
+        self.assertEqual(settings, (2, 6))
+        self.assertEqual(settings.Foo_c, 6)
+        self.assertIs(type(settings),
+                      type(config.extract(["a", "Foo.c"], typename="Settings")))
+        self.assertRaises(KeyError, config.extract, ["Foo.x"])
+        self.assertRaises(KeyError, config.extract, ["a.x"])
+        self.assertEqual(config.to_dict(),
+                         {"a": 2, "b": "x", "Baz": {"e": 4 + 2j},
+                          "Foo": {"c": 6, "Bar": {"d": [6, 1.5]}}})
+        self.assertEqual(list(config.to_dict()), ["a", "b", "Foo", "Baz"])
+        shallow = config.to_dict(recursive=False)
+        self.assertIs(shallow["Foo"], config.Foo)
+
+    def test_fold_constants(self):
+        source = ("a = 2\nb = a * (2 ** 10 * 3) + max([1, 2, 3])\n"
+                  "c = [1, 2 + 3]\nd = 1 / 0 + a\ne = (1, -2.5) if a else 1e308 * 10\n")
+        for compiled in (False, True):
+            config = parse_string(source, compiled=compiled)
+            config.fold_constants()
+            node = config.__getattribute__("b", True)._acp_ast_node
+            self.assertEqual(ast.dump(node), ast.dump(
+                ast.parse("a * 3072 + 3").body[0].value))
+            node = config.__getattribute__("c", True)._acp_ast_node
+            self.assertEqual(ast.dump(node), ast.dump(
+                ast.parse("[1, 5]").body[0].value))
+            node = config.__getattribute__("e", True)._acp_ast_node
+            self.assertIsInstance(node.body, ast.Constant)
+            self.assertIsInstance(node.orelse, ast.BinOp)
+            self.assertEqual(config.b, 2 * 3072 + 3)
+            self.assertEqual(config.c, [1, 5])
+            self.assertEqual(config.e, (1, -2.5))
+            self.assertRaises(ZeroDivisionError, getattr, config, "d")
+            self.assertEqual(config.dump(), source)
+            config.a = 3
+            self.assertEqual(config.b, 3 * 3072 + 3)
+        # values that could get large are left to the evaluation
+        config = parse_string("a = 'x' * 10 ** 8\nb = 2 ** 10 ** 9\n"
+                              "c = (1, 2) * 200\nd = '%*d' % (10 ** 8, 1)\n"
+                              "e = 'ab' * 3 + str(1 << 10)\n")
+        config.fold_constants()
+        for name in ("a", "b", "c", "d"):
+            node = config.__getattribute__(name, True)._acp_ast_node
+            self.assertIsInstance(node, ast.BinOp)
+        self.assertIsInstance(node.right, ast.Constant)
+        node = config.__getattribute__("e", True)._acp_ast_node
+        self.assertEqual(node.value, "ababab1024")
+
+    def test_iter_events(self):
+        events = list(iter_events(io.StringIO(
+            "a = 1\n# c\n[Foo]\n\nb = a\n[[Bar]]\n[Baz]\n")))
+        self.assertEqual([event[:3] for event in events],
+                         [("option", (), "a"), ("comment", (), "# c"),
+                          ("enter", ("Foo",)), ("empty", ("Foo",)),
+                          ("option", ("Foo",), "b"),
+                          ("enter", ("Foo", "Bar")), ("exit", ("Foo", "Bar")),
+                          ("exit", ("Foo",)), ("enter", ("Baz",)),
+                          ("exit", ("Baz",))])
+        self.assertIsInstance(events[0][3], ast.Constant)
+        self.assertEqual(events[4][4], "a")
+
+    def test_only(self):
+        source = ("a = 1\nb = 2\n[Foo]\nc = a\n# c\n[[Bar]]\nd = 4\n"
+                  "[[Baz]]\ne = 5\n[Skipped]\nf = 1 +\n"
+                  "[[Inner]]\ng = 7\n")
+        config = parse_string(source, only=["Foo.Bar", "Foo.c", "a"])
+        self.assertEqual(config.a, 1)
+        self.assertEqual(config.Foo.c, 1)
+        self.assertEqual(config.Foo.Bar.d, 4)
+        self.assertEqual(config.to_dict(),
+                         {"a": 1, "Foo": {"c": 1, "Bar": {"d": 4}}})
+        self.assertEqual(config.dump(), "a = 1\n[Foo]\n c = a\n [[Bar]]\n"
+                                        "  d = 4\n")
+        config = parse_string(source, only=["*.e", "Skip*.Inner"])
+        self.assertEqual(config.to_dict(),
+                         {"Foo": {"Baz": {"e": 5}},
+                          "Skipped": {"Inner": {"g": 7}}})
+        events = list(iter_events(io.StringIO("[A]\n[[B]]\ny = 2\n[C]\n"
+                                              "z = 3\n"), only=["*.y"]))
+        self.assertEqual([event[:2] for event in events],
+                         [("enter", ("A",)), ("enter", ("A", "B")),
+                          ("option", ("A", "B")), ("exit", ("A", "B")),
+                          ("exit", ("A",))])
+        self.assertRaises(SyntaxError, parse_string, source)
+
+    def test_lazy(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        filename = os.path.join(directory, "test.cfg")
+        source = ("# global\na = 1\n\n[Foo]\nb = Bar.c + a\nl = [\n"
+                  "[1, 2],\n]\n[[Sub]]\nd = 4\n# foo\n[Bar]\nc = 2\n"
+                  "[Broken]\ne = (\n")
+        with open(filename, "w") as f:
+            f.write(source)
+        config = parse_file(filename, lazy=True)
+        lazy = AdvancedConfigParser._LazySection
+        self.assertEqual([type(child) for child in config._acp_children()],
+                         [Option, lazy, lazy, lazy])
+        self.assertEqual(config.a, 1)
+        self.assertEqual(config.Foo.l, [[1, 2]])
+        self.assertIs(type(config._acp_get_child("Foo")),
+                      AdvancedConfigParser.Section)
+        self.assertIs(type(config._acp_get_child("Bar")), lazy)
+        self.assertEqual(config.Foo.b, 3)
+        self.assertIs(type(config._acp_get_child("Bar")),
+                      AdvancedConfigParser.Section)
+        self.assertEqual(config["Foo"].Sub.d, 4)
+        self.assertIs(config.Foo.Sub._acp_parent, config.Foo)
+        # errors show up when the broken section is accessed
+        self.assertRaises(SyntaxError, getattr, config.Broken, "e")
+        # errors report the line in the file
+        self.assertRaisesRegex(SyntaxError, "line 15", getattr,
+                               config.Broken, "e")
+        config.Bar.c = 5
+        self.assertEqual(config.Foo.b, 6)
+        eager = parse_string(source.replace("e = (\n", ""))
+        with open(filename, "w") as f:
+            f.write(eager.dump())
+        self.assertEqual(parse_file(filename, lazy=True).dump(), eager.dump())
+        with open(filename, "w") as f:
+            f.write("[Foo]\n[Foo]\n")
+        self.assertRaises(SyntaxError, parse_file, filename, lazy=True)
+        # unloaded sections of a rewritten file fail to load
+        with open(filename, "w") as f:
+            f.write("a = 1\n[Foo]\nb = 2\n[Bar]\nc = 3\n")
+        config = parse_file(filename, lazy=True)
+        self.assertEqual(config.Foo.b, 2)
+        with open(filename, "w") as f:
+            f.write("a = 1\n[Foo]\nb = 2\n")
+        with self.assertRaisesRegex(RuntimeError, "changed"):
+            config.Bar.c
+        self.assertEqual(config.Foo.b, 2)
+
+    def test_overlay(self):
+        base = parse_string("a = 1\nb = a + 1\n[Foo]\nc = b * 10\n"
+                            "[[Bar]]\nd = Foo.c + a\n[Baz]\ne = 3\n")
+        override = parse_string("a = 5\n[Foo]\n[[Bar]]\nx = d * 2\n"
+                                "[Baz]\ne = 4\n[Qux]\nf = b\n")
+        overlay = AdvancedConfigParser.Overlay(base, override)
+        self.assertEqual(overlay.b, 6)
+        self.assertEqual(overlay.Foo.Bar.d, 65)
+        self.assertEqual(overlay.Foo.Bar.x, 130)
+        self.assertEqual(overlay.Baz.e, 4)
+        self.assertEqual(overlay.Qux.f, 6)
+        # sections are only set up when they are accessed
+        self.assertIs(type(overlay._acp_get_child("Baz")),
+                      AdvancedConfigParser.Section)
+        tenant = AdvancedConfigParser.Overlay(base)
+        self.assertIs(type(tenant._acp_get_child("Baz")),
+                      AdvancedConfigParser.Overlay)
+        # writes stay in the overlay
+        overlay.Foo.c = 7
+        tenant.a = 100
+        self.assertEqual(overlay.Foo.Bar.d, 12)
+        self.assertEqual(tenant.Foo.Bar.d, 1110)
+        self.assertEqual((base.a, base.b, base.Foo.c, base.Foo.Bar.d),
+                         (1, 2, 20, 21))
+        self.assertEqual(AdvancedConfigParser.Overlay(overlay, tenant).a, 100)
+        self.assertEqual(overlay.dump(),
+                         "a = 5\nb = a + 1\n[Foo]\n c = 7\n [[Bar]]\n"
+                         "  d = Foo.c + a\n  x = d * 2\n[Baz]\n e = 4\n"
+                         "[Qux]\n f = b\n")
+
+    def test_overlay_follows_layers(self):
+        base = parse_string("# head\na = 1\nb = a + 1\n\n[Foo]\nc = b * 10\n"
+                            "[Bar]\nd = 4\n")
+        override = parse_string("# head\n\n[Foo]\nx = c + 1\n")
+        overlay = AdvancedConfigParser.Overlay(base, override)
+        self.assertEqual((overlay.b, overlay.Foo.x, overlay.Bar.d), (2, 21, 4))
+        # comments and empty lines are not repeated for every layer
+        self.assertEqual(overlay.dump(),
+                         "# head\na = 1\nb = a + 1\n\n[Foo]\n c = b * 10\n"
+                         " x = c + 1\n[Bar]\n d = 4\n")
+        base.a = 7
+        self.assertEqual((overlay.b, overlay.Foo.x), (8, 81))
+        base.Bar.d = ast.parse("a * 2").body[0].value
+        self.assertEqual(overlay.Bar.d, 14)
+        reload_string(base, "a = 2\nb = a + 1\ne = 5\n[Foo]\nc = b * 10\n")
+        self.assertEqual((overlay.b, overlay.e, overlay.Foo.x), (3, 5, 31))
+        self.assertIsNone(overlay._acp_get_child("Bar"))
+        reload_string(base, "a = 2\nb = a + 1\ne = 5\n[Foo]\nc = b * 10\n"
+                            "[Bar]\nd = 6\n")
+        self.assertEqual(overlay.Bar.d, 6)
+        # options set in the overlay are kept
+        overlay.a = 100
+        base.a = 3
+        self.assertEqual((overlay.b, base.b), (101, 4))
+        # dropped overlays are not kept alive by their layers
+        ref = weakref.ref(overlay)
+        del overlay
+        gc.collect()
+        self.assertIsNone(ref())
+        self.assertEqual(base.Foo.__dict__["c"]._acp_dependents, set())
+
+    def test_block_reads(self):
+        source = ("# head\n  \na = 1\n[Foo]\n  # indented\nb = [a,\n"
+                  "     2]\nc = '''x\ny'''\nd = (a +\r\n 3)\ne = 'z'")
+        expected = list(AdvancedConfigParser._acp_iter_lines(
+            io.StringIO(source)))
+        self.addCleanup(setattr, AdvancedConfigParser, "_READ_SIZE",
+                        AdvancedConfigParser._READ_SIZE)
+        for size in (1, 2, 7):
+            AdvancedConfigParser._READ_SIZE = size
+            self.assertEqual(list(AdvancedConfigParser._acp_iter_lines(
+                io.StringIO(source))), expected)
+        self.assertEqual([kind for kind, line, text in expected],
+                         ["comment", "empty", "option", "section", "comment",
+                          "option", "option", "option", "option"])
+        self.assertEqual(expected[6], ("option", 8, "c = '''x\ny'''"))
+        config = parse_string(source)
+        self.assertEqual((config.Foo.b, config.Foo.d, config.Foo.e),
+                         ([1, 2], 4, "z"))
+
+    def test_async(self):
+        import asyncio
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        filename = os.path.join(directory, "test.cfg")
+        with open(filename, "w") as f:
+            f.write("a = 1\n[Foo]\nb = a + 1\n")
+        async def run():
+            config = await AdvancedConfigParser.parse_file_async(filename)
+            self.assertEqual(config.Foo.b, 2)
+            reader = asyncio.StreamReader()
+            source = "".join("o{i} = {i}\n".format(i=i) for i in range(20000))
+            reader.feed_data(source.encode("utf-8"))
+            reader.feed_eof()
+            config = await AdvancedConfigParser.parse_stream_async(reader)
+            self.assertEqual(config.o19999, 19999)
+            holder = AdvancedConfigParser.AsyncConfigFile(filename)
+            old = await holder.load()
+            self.assertEqual(old.Foo.b, 2)
+            with open(filename, "w") as f:
+                f.write("a = 2\n[Foo]\nb = a + 1\n")
+            results = await asyncio.gather(holder.reload(),
+                                           holder.reload())
+            self.assertIs(results[-1], holder.root)
+            self.assertIsNot(holder.root, old)
+            self.assertEqual(holder.root.Foo.b, 3)
+            self.assertEqual(old.Foo.b, 2)
+            with open(filename, "w") as f:
+                f.write("a = (\n")
+            current = holder.root
+            with self.assertRaises(SyntaxError):
+                await holder.reload()
+            self.assertIs(holder.root, current)
+        asyncio.run(run())
+
+    def test_instrumentation(self):
+        config = parse_string("a = 2\n[Foo]\nb = a * 3\nc = [b, b + a]\n")
+        events = []
+        with AdvancedConfigParser.Instrumentation(
+                lambda *event: events.append(event[:2])) as instrumentation:
+            self.assertRaises(RuntimeError,
+                              AdvancedConfigParser.Instrumentation().start)
+            self.assertEqual(config.Foo.c, [6, 8])
+            self.assertEqual(config.Foo.c, [6, 8])
+            self.assertEqual(config.Foo.b, 6)
+        self.assertIs(type(Option._acp_value), LazyEval)
+        stats = instrumentation.stats()
+        self.assertEqual(stats["options"]["Foo.c"],
+                         {"evaluations": 1, "hits": 1,
+                          "seconds": stats["options"]["Foo.c"]["seconds"]})
+        self.assertEqual(stats["options"]["Foo.b"]["evaluations"], 1)
+        self.assertEqual(stats["options"]["Foo.b"]["hits"], 2)
+        self.assertEqual(stats["options"]["a"]["evaluations"], 1)
+        self.assertEqual((stats["hits"], stats["misses"]), (4, 3))
+        self.assertAlmostEqual(stats["hit_ratio"], 4 / 7.0)
+        self.assertGreater(stats["nodes"], 0)
+        references = dict((entry["reference"], entry)
+                          for entry in stats["references"])
+        self.assertEqual(references["b"]["resolutions"], 2)
+        self.assertEqual(references["b"]["section"], "Foo")
+        self.assertEqual(references["b"]["depth"], 2)
+        self.assertIn(("evaluate", "Foo.c"), events)
+        self.assertIn(("resolve", "a"), events)
+        self.assertIn(("hit", "Foo.b"), events)
+        # nothing is recorded after stopping
+        config.a = 3
+        self.assertEqual(config.Foo.c, [9, 12])
+        self.assertEqual(instrumentation.stats()["options"]["Foo.c"]
+                         ["evaluations"], 1)
+
+    def test_lazy_imports(self):
+        import subprocess
+        script = ("import sys, AdvancedConfigParser\n"
+                  "config = AdvancedConfigParser.parse_string('a = [1]')\n"
+                  "config.a\n"
+                  "print(' '.join(sorted(set(sys.modules) & set(sys.argv))))\n")
+        modules = ["pickle", "hashlib", "fnmatch", "mmap", "ast_to_src"]
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.path.dirname(os.path.abspath(
+            AdvancedConfigParser.__file__))
+        output = subprocess.check_output(
+            [sys.executable, "-c", script] + modules, env=env)
+        self.assertEqual(output.split(), [])
+        self.assertEqual(parse_string("a = [1, (2,), {3}]").dump(),
+                         "a = [1, (2,), {3}]\n")
+
+
+class TestConcurrency(unittest.TestCase):
+    """
+    stress tests sharing one parsed tree between threads.
+    """
+    def setUp(self):
+        interval = sys.getswitchinterval()
+        self.addCleanup(sys.setswitchinterval, interval)
+        sys.setswitchinterval(1e-6)
+
+    def run_threads(self, targets):
+        errors = []
+        def run(target):
+            try:
+                target()
+            except BaseException as e:
+                errors.append(e)
+        threads = [threading.Thread(target=run, args=(target,))
+                   for target in targets]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+            self.assertFalse(thread.is_alive())
+        return errors
+
+    def slow_eval(self, config, names):
+        """
+        make evaluating the options called names take a while and count
+        how often that happens.
+        """
+        evaluator = Option._acp_value
+        nodes = dict((id(config.__getattribute__(name, True)._acp_ast_node),
+                      name) for name in names)
+        counts = dict((name, 0) for name in names)
+        def _acp_eval(parent, node, deps):
+            if id(node) in nodes:
+                counts[nodes[id(node)]] += 1
+                time.sleep(0.05)
+            return LazyEval._acp_eval(evaluator, parent, node, deps)
+        evaluator._acp_eval = _acp_eval
+        self.addCleanup(delattr, evaluator, "_acp_eval")
+        return counts
+
+    def test_readers_and_writer(self):
+        config = parse_string("a = 0\n[Foo]\nb = a * 2\nc = b + a\n"
+                              "[[Bar]]\nd = c * 2\n")
+        done = []
+        def read():
+            while not done:
+                self.assertEqual(config.Foo.c % 3, 0)
+                self.assertEqual(config.Foo.Bar.d % 6, 0)
+        def write():
+            for i in range(1, 500):
+                config.a = i
+            done.append(True)
+        errors = self.run_threads([read] * 8 + [write])
+        self.assertEqual(errors, [])
+        self.assertEqual(config.Foo.Bar.d, 499 * 6)
+
+    def test_unrelated_writer(self):
+        config = parse_string("a = 2\nb = a ** 10\n[Foo]\nc = 0\n")
+        counts = self.slow_eval(config, ["b"])
+        done = []
+        def write():
+            i = 0
+            while not done:
+                i += 1
+                config.Foo.c = i
+                time.sleep(0.01)
+        def read():
+            try:
+                self.assertEqual(config.b, 1024)
+            finally:
+                done.append(True)
+        self.assertEqual(self.run_threads([read, write]), [])
+        self.assertEqual(counts["b"], 1)
+
+    def test_evaluated_once(self):
+        config = parse_string("a = 2\nb = a ** 10\n")
+        counts = self.slow_eval(config, ["b"])
+        barrier = threading.Barrier(8)
+        results = []
+        def read():
+            barrier.wait()
+            results.append(config.b)
+        self.assertEqual(self.run_threads([read] * 8), [])
+        self.assertEqual(results, [1024] * 8)
+        self.assertEqual(counts["b"], 1)
+
+    def test_reference_cycle(self):
+        config = parse_string("a = b + 1\nb = a + 1\n")
+        self.slow_eval(config, ["a", "b"])
+        errors = self.run_threads([lambda: config.a, lambda: config.b])
+        self.assertEqual(len(errors), 2)
+        for error in errors:
+            self.assertIsInstance(error, RuntimeError)
+
+
+class TestParallel(unittest.TestCase):
+    """
+    tests parsing in a pool of worker processes.
+    """
+    def test_merge_order(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        sources = ["a = 1\nb = a + 1\n[Foo]\nc = b * 10\n[[Bar]]\nd = 4\n"
+                   "[Baz]\ne = [a, b]\n",
+                   "# override\na = 5\n[Foo]\n[[Bar]]\nd = c + 1\nf = 6\n"
+                   "[Qux]\ng = a\n"]
+        filenames = []
+        for i, source in enumerate(sources):
+            filenames.append(os.path.join(directory, "{0}.cfg".format(i)))
+            with open(filenames[-1], "w") as f:
+                f.write(source)
+        for workers in (1, 2):
+            config = AdvancedConfigParser.parse_files(filenames,
+                                                      workers=workers)
+            self.assertEqual(config.a, 5)
+            self.assertEqual(config.Foo.c, 60)
+            self.assertEqual(config.Foo.Bar.d, 61)
+            self.assertEqual(config.Foo.Bar.f, 6)
+            self.assertEqual(config.Baz.e, [5, 6])
+            self.assertEqual(config.Qux.g, 5)
+            self.assertEqual(config.dump().split("\n")[:2], ["a = 5",
+                                                             "b = a + 1"])
+            # a single file is split at its top-level sections
+            single = AdvancedConfigParser.parse_files(filenames[:1],
+                                                      workers=workers)
+            with open(filenames[0]) as f:
+                self.assertEqual(single.dump(), parse_string(f.read()).dump())
+        with open(filenames[1], "a") as f:
+            f.write("[Error]\nh = (\n")
+        with self.assertRaisesRegex(SyntaxError, "line 10"):
+            AdvancedConfigParser.parse_files(filenames, workers=2)
+
 if __name__ == '__main__':
     unittest.main()